@@ -1,14 +1,25 @@
+import os
+import time
+import shutil
+import argparse
+import threading
 import pygame
 import numpy as np
 from pygame.locals import *
 from random import Random
-from collections import OrderedDict
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import shared_memory, resource_tracker
 from scipy.stats import poisson
 from buddysuite import buddy_resources as br
 
 rand = Random()
+np_rand = np.random.default_rng()
 STATES = ["fwd", "rev", "left", "right", "stop"]
+GENOME_MATRICES = ["p_dark", "p_light", "p_dark_wall", "p_light_wall"]
+STATE_INDEX = {state: indx for indx, state in enumerate(STATES)}
 type_colors = {0: (0, 0, 0), 1: (255, 255, 255), 2: (0, 128, 255), 3: (255, 100, 0), 4: (152, 251, 152)}
+color_table = np.array([type_colors[i] for i in range(len(type_colors))], dtype=np.uint8)
 
 
 def weighted_choice(items, weights, number=1, replacement=False, return_index=False):
@@ -50,11 +61,13 @@ def flood_fill(x_ori, y_ori, edges):
     :return:
     """
     surface = edges
+    filled = set(surface)  # Membership checks against the list itself make this quadratic
     stack = [(x_ori, y_ori)]
     while len(stack) > 0:
         x, y = stack.pop()
-        if (x, y) in surface:
+        if (x, y) in filled:
             continue
+        filled.add((x, y))
         surface.append((x, y))
         stack.append((x + 1, y))  # right
         stack.append((x - 1, y))  # left
@@ -106,6 +119,27 @@ def define_circle_edges(len_side, pixel_size, x0=0, y0=0, fill=False):
     return edges
 
 
+dish_cache = {}
+
+
+def dish_geometry(len_side, pixel_size):
+    """
+    Edge and surface spaces of the circular dish. The geometry only depends on the world size, so it is cached for the
+    life of the process and every World of the same size gets its own copy of the cached dicts.
+    :param len_side: The length of a side as passed into PyGame
+    :param pixel_size: How many side units are contained in a single 'pixel' in the actual grid
+    :return: (dish_edges, dish_surface) dicts, keyed by (x, y)
+    """
+    if (len_side, pixel_size) not in dish_cache:
+        dish_edges = {tup: None for tup in define_circle_edges(len_side, pixel_size)}
+        dish_surface = {tup: None for tup in define_circle_edges(len_side, pixel_size, fill=True)}
+        for edge in dish_edges:
+            del dish_surface[edge]
+        dish_cache[(len_side, pixel_size)] = (dish_edges, dish_surface)
+    dish_edges, dish_surface = dish_cache[(len_side, pixel_size)]
+    return dict(dish_edges), dict(dish_surface)
+
+
 class World(object):
     def __init__(self, len_side, pixel_size):
         """
@@ -123,13 +157,13 @@ class World(object):
 
         # Initiate the environment
         pix_per_side = int(len_side / pixel_size)
-        self.grid = [[None for _ in range(pix_per_side)] for _ in range(pix_per_side)]
-        self.dish_edges = {tup: None for tup in define_circle_edges(len_side, pixel_size)}
-        self.dish_surface = {tup: None for tup in define_circle_edges(len_side, pixel_size, fill=True)}
-        for edge in self.dish_edges:
-            del self.dish_surface[edge]
-        self.light_spots = {}
+        # Everything reads as out of bounds until the first tick fills the grid in, so it is always plain ints
+        self.grid = [[0 for _ in range(pix_per_side)] for _ in range(pix_per_side)]
+        self.dish_edges, self.dish_surface = dish_geometry(len_side, pixel_size)
+        self.light_field = LightField(pix_per_side)
+        self.light = self.light_field.mask(0)
         self.food_locations = {}
+        self.analytics = Analytics()
 
         # Set a few global variables
         self.pop_size = 0
@@ -141,6 +175,135 @@ class World(object):
             self.food_locations[food] = None
         return
 
+    def update_light(self, tick):
+        """
+        Swap in the light mask for the current tick. Masks come out of the LightField cache, so this doesn't depend on
+        population size (or, usually, on world size).
+        :param tick: Current tick number
+        :return: None
+        """
+        self.light = self.light_field.mask(tick)
+        return
+
+
+class LightSpot(object):
+    def __init__(self, x, y, radius, intensity=1., gradient=False, velocity=(0, 0)):
+        """
+        A circular patch of light
+        :param x: Center x position at tick 0
+        :param y: Center y position at tick 0
+        :param radius: Radius in grid cells
+        :param intensity: Light intensity at the center of the spot (0-1). This is the probability that a worm senses
+                          the light, so anything less than 1 makes the spot 'dim'.
+        :param gradient: Fade the intensity linearly to zero at the edge of the spot
+        :param velocity: (dx, dy) grid cells per tick. The world is a torus as far as light is concerned, so a spot
+                         crossing an edge shows up on the opposite side rather than being clipped.
+        """
+        if not 0 <= intensity <= 1:
+            raise ValueError("Light intensity must be between 0 and 1")
+        self.x = x
+        self.y = y
+        self.radius = radius
+        self.intensity = intensity
+        self.gradient = gradient
+        self.velocity = velocity
+
+    def position(self, tick, size):
+        """
+        Where the center of the spot is at a given tick, rounded to the nearest grid cell
+        :param tick: Tick number
+        :param size: Length of a side of the world grid
+        :return: (x, y)
+        """
+        return (int(round(self.x + self.velocity[0] * tick)) % size,
+                int(round(self.y + self.velocity[1] * tick)) % size)
+
+    def render(self, mask, x, y):
+        """
+        Light up `mask` in place, keeping the brightest value where spots overlap. Distances wrap around the edges.
+        :param mask: 2D np.array, indexed [x][y]
+        :param x: Center x position
+        :param y: Center y position
+        :return: None
+        """
+        xs, ys = np.ogrid[:mask.shape[0], :mask.shape[1]]
+        dx = np.abs(xs - x)
+        dy = np.abs(ys - y)
+        dx = np.minimum(dx, mask.shape[0] - dx)
+        dy = np.minimum(dy, mask.shape[1] - dy)
+        dist = np.sqrt(dx ** 2 + dy ** 2)
+        if self.gradient:
+            spot = self.intensity * np.clip(1 - dist / (self.radius + 1), 0, 1)
+        else:
+            spot = np.where(dist <= self.radius, self.intensity, 0)
+        np.maximum(mask, spot, out=mask)
+        return
+
+
+class LightField(object):
+    def __init__(self, size, schedule=None, cache_size=64):
+        """
+        Time-varying light, described as a cyclic schedule of phases. Masks are generated the first time a particular
+        phase/spot-position combination comes up and are kept in a least-recently-used cache, so static phases are
+        only ever rendered once and periodic motion is rendered once per period (if it fits in the cache).
+        :param size: Length of a side of the world grid
+        :param schedule: List of (duration, [LightSpot, ...]) tuples, run in order and then repeated. A phase with no
+                         spots is 'lights off'. Default is darkness forever.
+        :param cache_size: Maximum number of masks to hold in memory
+        """
+        self.size = size
+        self.schedule = schedule if schedule else [(1, [])]
+        if any(duration < 1 for duration, spots in self.schedule):
+            raise ValueError("Light phases must last at least one tick")
+        self.period = sum(duration for duration, spots in self.schedule)
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+
+    def phase(self, tick):
+        """
+        :param tick: Tick number
+        :return: Index of the schedule phase active at `tick`
+        """
+        tick %= self.period
+        for indx, (duration, spots) in enumerate(self.schedule):
+            if tick < duration:
+                return indx
+            tick -= duration
+
+    def mask(self, tick):
+        """
+        Light intensity across the grid at a given tick
+        :param tick: Tick number
+        :return: 2D np.array of floats between 0 and 1, indexed [x][y]. Treat as read-only, it is shared by the cache.
+        """
+        indx = self.phase(tick)
+        spots = self.schedule[indx][1]
+        key = (indx, tuple(spot.position(tick, self.size) for spot in spots))
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+
+        mask = np.zeros((self.size, self.size))
+        for spot, (x, y) in zip(spots, key[1]):
+            spot.render(mask, x, y)
+        mask.flags.writeable = False
+        self.cache[key] = mask
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return mask
+
+    def precompute(self):
+        """
+        Render every phase that has no moving spots, so the masks are ready before the simulation starts
+        :return: None
+        """
+        tick = 0
+        for duration, spots in self.schedule:
+            if not any(spot.velocity[0] or spot.velocity[1] for spot in spots):
+                self.mask(tick)
+            tick += duration
+        return
+
 
 class Genome(object):
     def __init__(self, p_dark=None, p_light=None, p_dark_wall=None, p_light_wall=None):
@@ -155,14 +318,294 @@ class Genome(object):
         self.p_light = p_light if p_light else random_transition_matrix(STATES)
         self.p_dark_wall = p_dark_wall if p_dark_wall else random_transition_matrix(STATES)
         self.p_light_wall = p_light_wall if p_light_wall else random_transition_matrix(STATES)
+        self._array = None
+
+    def as_array(self):
+        """
+        Cached numpy view of all four transition matrices (see genome_to_array()). Genomes are never mutated after
+        they are created, so the array only needs to be built once.
+        :return: np.array with shape (4, len(STATES), len(STATES))
+        """
+        if self._array is None:
+            self._array = genome_to_array(self)
+        return self._array
+
+
+class Analytics(object):
+    def __init__(self, record_every=1, chunk_size=1000, spool_dir=None):
+        """
+        Running population-genetics statistics, updated incrementally as worms are born and culled so nothing needs
+        to be recomputed from the full population each tick.
+        Genome means and variances are maintained with Welford's online algorithm (which also supports removal).
+
+        Recorded rows go into preallocated chunks. With `spool_dir` set, each full chunk is appended to raw files on
+        disk and the buffer is reused, so memory stays flat however long the run is (and the data survives a crash).
+        Otherwise full chunks are kept in memory, and `record_every` is the way to keep long runs small.
+        :param record_every: Only store every Nth tick in the time series
+        :param chunk_size: Rows per buffer
+        :param spool_dir: Directory to append full chunks to
+        """
+        if record_every < 1 or chunk_size < 1:
+            raise ValueError("record_every and chunk_size must be positive integers")
+        shape = (len(GENOME_MATRICES), len(STATES), len(STATES))
+        self.count = 0
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+        # Reset every tick, incremented by Worm.step()
+        self.stepped = 0
+        self.in_light = 0
+        self.last_light_fraction = 0.
+
+        self.record_every = record_every
+        self.spool_dir = spool_dir
+        self.fields = OrderedDict([("tick", ((), np.int64)), ("pop_size", ((), np.int64)),
+                                   ("light_fraction", ((), np.float64)), ("diversity", ((), np.float64)),
+                                   ("mean", (shape, np.float64)), ("variance", (shape, np.float64))])
+        self.chunk = OrderedDict([(key, np.zeros((chunk_size,) + shape, dtype=dtype))
+                                  for key, (shape, dtype) in self.fields.items()])
+        self.chunk_rows = 0
+        self.chunks = []  # Full chunks held in memory (when not spooling)
+        self.rows = 0
+
+    def add(self, worm):
+        x = worm.genome.as_array()
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+        return
+
+    def remove(self, worm):
+        x = worm.genome.as_array()
+        if self.count <= 1:
+            self._reset_sums()
+            return
+        self.count -= 1
+        delta = x - self.mean
+        self.mean -= delta / self.count
+        self.m2 -= delta * (x - self.mean)
+        return
+
+    def _reset_sums(self):
+        self.count = 0
+        self.mean[:] = 0
+        self.m2[:] = 0
+        return
+
+    def variance(self):
+        """
+        Population variance of every transition probability
+        :return: np.array with the same shape as Genome.as_array()
+        """
+        if not self.count:
+            return np.zeros(self.m2.shape)
+        return np.clip(self.m2 / self.count, 0, None)
+
+    def diversity(self):
+        """
+        Simple measure of genetic diversity: the average variance across all transition probabilities
+        :return: float
+        """
+        return float(self.variance().mean())
+
+    def light_fraction(self):
+        """
+        Fraction of the worms stepped this tick that started their step in the light
+        :return: float
+        """
+        return self.in_light / self.stepped if self.stepped else 0.
+
+    def record(self, tick):
+        """
+        Close out a tick: store a row in the time series (every `record_every` ticks) and reset the per-tick counters.
+        The light fraction for the tick is kept in `last_light_fraction` either way.
+        :param tick: The current tick number
+        :return: None
+        """
+        self.last_light_fraction = self.light_fraction()
+        self.stepped = 0
+        self.in_light = 0
+        if tick % self.record_every:
+            return
+
+        row = self.chunk_rows
+        self.chunk["tick"][row] = tick
+        self.chunk["pop_size"][row] = self.count
+        self.chunk["light_fraction"][row] = self.last_light_fraction
+        self.chunk["variance"][row] = self.variance()
+        self.chunk["diversity"][row] = self.chunk["variance"][row].mean()
+        self.chunk["mean"][row] = self.mean
+        self.chunk_rows += 1
+        self.rows += 1
+        if self.chunk_rows == len(self.chunk["tick"]):
+            self.flush()
+        return
+
+    def flush(self):
+        """
+        Move the rows in the current buffer to the spool files (or the list of full chunks) and empty the buffer
+        :return: None
+        """
+        if not self.chunk_rows:
+            return
+        if self.spool_dir:
+            os.makedirs(self.spool_dir, exist_ok=True)
+            for key, array in self.chunk.items():
+                with open(os.path.join(self.spool_dir, "%s.bin" % key), "ab") as ofile:
+                    array[:self.chunk_rows].tofile(ofile)
+        else:
+            self.chunks.append(OrderedDict([(key, array[:self.chunk_rows].copy())
+                                            for key, array in self.chunk.items()]))
+        self.chunk_rows = 0
+        return
+
+    def time_series(self):
+        """
+        Everything recorded so far, from the spool files, any full chunks and the current buffer
+        :return: OrderedDict of field name -> np.array with one row per recorded tick
+        """
+        series = OrderedDict()
+        for key, (shape, dtype) in self.fields.items():
+            parts = []
+            spool_file = os.path.join(self.spool_dir, "%s.bin" % key) if self.spool_dir else None
+            if spool_file and os.path.isfile(spool_file):
+                parts.append(np.fromfile(spool_file, dtype=dtype).reshape((-1,) + shape))
+            parts += [chunk[key] for chunk in self.chunks]
+            parts.append(self.chunk[key][:self.chunk_rows])
+            series[key] = np.concatenate(parts)
+        return series
+
+    def save(self, path, **metadata):
+        """
+        Write the time series to disk as a compressed numpy archive
+        :param path: Output file
+        :param metadata: Any extra values to store alongside the time series (e.g., why a run stopped). Keys must not
+        clash with a time series name, 'states' or 'matrices'.
+        :return: None
+        """
+        clashes = sorted(set(metadata) & (set(self.fields) | {"states", "matrices"}))
+        if clashes:
+            raise ValueError("Metadata keys clash with saved arrays: %s" % ", ".join(clashes))
+        arrays = self.time_series()
+        arrays.update([(key, np.array(val)) for key, val in metadata.items()])
+        np.savez_compressed(path, states=np.array(STATES), matrices=np.array(GENOME_MATRICES), **arrays)
+        return
+
+
+class SlidingWindow(object):
+    def __init__(self, size):
+        """
+        Fixed-length window of values with running totals, so the mean and standard deviation are O(1) to update.
+        Works with scalars or numpy arrays (element-wise).
+        :param size: Number of values to hold
+        """
+        if size < 2:
+            raise ValueError("Window size must be at least 2")
+        self.size = size
+        self.values = deque()
+        self.total = 0.
+        self.total_sq = 0.
+        self._pushes = 0
+
+    def push(self, value):
+        self.values.append(value)
+        self.total = self.total + value
+        self.total_sq = self.total_sq + value * value
+        if len(self.values) > self.size:
+            old = self.values.popleft()
+            self.total = self.total - old
+            self.total_sq = self.total_sq - old * old
+        # Re-sum every so often so floating point error can't accumulate over long runs
+        self._pushes += 1
+        if not self._pushes % self.size:
+            self.total = sum(self.values)
+            self.total_sq = sum(val * val for val in self.values)
+        return
+
+    def full(self):
+        return len(self.values) == self.size
+
+    def mean(self):
+        return self.total / len(self.values)
+
+    def std(self):
+        mean = self.mean()
+        return np.sqrt(np.maximum(self.total_sq / len(self.values) - mean * mean, 0))
+
+
+class ConvergenceMonitor(object):
+    def __init__(self, window=500, tolerance=0.05, genome_tolerance=0.005, max_ticks=None, max_seconds=None):
+        """
+        Decide when a run can stop. The population is called converged once sum_suntan and sum_food_eaten have a
+        coefficient of variation below `tolerance` over the last `window` ticks, and no population genome mean has a
+        standard deviation above `genome_tolerance` over the same window.
+        :param window: Number of ticks to look back over
+        :param tolerance: Maximum relative standard deviation (std / mean) of the summary sums
+        :param genome_tolerance: Maximum standard deviation of any population mean transition probability
+        :param max_ticks: Stop after this many ticks regardless
+        :param max_seconds: Stop after this much wall time regardless
+        """
+        self.window = window
+        self.tolerance = tolerance
+        self.genome_tolerance = genome_tolerance
+        self.max_ticks = max_ticks
+        self.max_seconds = max_seconds
+        self.suntan = SlidingWindow(window)
+        self.food = SlidingWindow(window)
+        self.genome = SlidingWindow(window)
+        self.start_time = None
+        self.ticks = 0
+        self.reason = None
+
+    def update(self, world, tick):
+        """
+        Add the current state of the world and check all of the stopping criteria
+        :param world: World object
+        :param tick: Current tick number
+        :return: The reason to stop ('converged', 'tick budget' or 'time budget'), or None to keep going
+        """
+        if self.start_time is None:
+            self.start_time = time.time()
+        self.ticks = tick + 1
+        self.suntan.push(world.sum_suntan)
+        self.food.push(world.sum_food_eaten)
+        self.genome.push(world.analytics.mean.copy())
+
+        if self.suntan.full() and self.stable():
+            self.reason = "converged"
+        elif self.max_ticks and self.ticks >= self.max_ticks:
+            self.reason = "tick budget"
+        elif self.max_seconds and time.time() - self.start_time >= self.max_seconds:
+            self.reason = "time budget"
+        return self.reason
+
+    def stable(self):
+        for sums in [self.suntan, self.food]:
+            if sums.std() > self.tolerance * abs(sums.mean()):
+                return False
+        return bool(self.genome.std().max() <= self.genome_tolerance)
+
+    def report(self, world):
+        """
+        Summary of the final state of a run
+        :param world: World object
+        :return: OrderedDict
+        """
+        return OrderedDict([("reason", self.reason), ("ticks", self.ticks),
+                            ("seconds", time.time() - self.start_time if self.start_time is not None else 0.),
+                            ("pop_size", world.pop_size), ("sum_food_eaten", world.sum_food_eaten),
+                            ("sum_suntan", world.sum_suntan),
+                            ("light_fraction", world.analytics.last_light_fraction),
+                            ("diversity", world.analytics.diversity())])
 
 
 class Worm(object):
-    def __init__(self, world, genome):
+    def __init__(self, world, genome, location=None):
         """
         Create a virtual worm object
         :param world: World object
         :param genome: Genome object
+        :param location: (x, y) starting position. Default is a random spot on the dish surface.
 
         Directions:
         0 = Up
@@ -171,7 +614,7 @@ class Worm(object):
         3 = Left
         """
         self.world = world
-        self.x, self.y = rand.choice(list(self.world.dish_surface.keys()))
+        self.x, self.y = location if location else rand.choice(list(self.world.dish_surface.keys()))
         self.direction = rand.choice([0, 1, 2, 3])
         self.state = rand.choice(STATES)
         self.genome = genome
@@ -180,6 +623,7 @@ class Worm(object):
         self.time_in_light = 1
         self.world.sum_suntan += 1
         self.world.pop_size += 1
+        self.world.analytics.add(self)
 
     def step(self, *args):
         """
@@ -189,9 +633,12 @@ class Worm(object):
         """
         if args:
             pass
-        if (self.x, self.y) in self.world.light_spots:
+        self.world.analytics.stepped += 1
+        lit = is_lit(self.world, self.x, self.y)
+        if lit:
             self.time_in_light += 1
             self.world.sum_suntan += 1
+            self.world.analytics.in_light += 1
         else:
             if self.time_in_light > 1:
                 self.time_in_light -= 1
@@ -205,12 +652,14 @@ class Worm(object):
         if self.food > 0:
             self.food -= 1
             self.world.sum_food_eaten -= 1
-        self.move()
+        self.move(lit)
         return
 
-    def move(self, *args):
+    def move(self, lit=None, *args):
         """
         Execute an action from the appropriate movement transition matrix
+        :param lit: Whether the worm senses light. step() passes in what it already sampled, so a worm in dim light
+                    behaves consistently with how its time in the light was counted. Default is to check now.
         :param args: Not currently used for anything
         :return:
         """
@@ -218,10 +667,12 @@ class Worm(object):
             pass
 
         wall = False
+        if lit is None:
+            lit = is_lit(self.world, self.x, self.y)  # Bumping a wall doesn't change position, so only look once
         for i in range(2):  # This allows a wall to be bumped into and responded to, but if they bump again, too bad.
             action = rand.random()
             sum_options = 0
-            if (self.x, self.y) in self.world.light_spots:
+            if lit:
                 prob_set = self.genome.p_light if not wall else self.genome.p_light_wall
             else:
                 prob_set = self.genome.p_dark if not wall else self.genome.p_dark_wall
@@ -330,9 +781,8 @@ class Worm(object):
                 p_light_wall[i][j] = rand.choice([self.genome.p_light_wall[i][j], mate.genome.p_light_wall[i][j]])
 
         new_genome = Genome(p_dark, p_light, p_dark_wall, p_light_wall)
-        worm = Worm(self.world, new_genome)
         # Place the offspring in an adjacent (or the same) space
-        worm.x, worm.y = rand.choice(self.adjacent_spaces())
+        worm = Worm(self.world, new_genome, location=rand.choice(self.adjacent_spaces()))
         self.world.grid[worm.x][worm.y] = 3
         return worm
 
@@ -346,6 +796,97 @@ class Worm(object):
         return spaces
 
 
+def is_lit(world, x, y):
+    """
+    Check whether a worm at (x, y) senses light. Full intensity is always sensed and darkness never is, so the random
+    draw only happens in dim light.
+    :param world: World object
+    :param x:
+    :param y:
+    :return: bool
+    """
+    intensity = world.light[x, y]
+    return bool(intensity >= 1 or (intensity > 0 and rand.random() < intensity))
+
+
+def genome_to_array(genome):
+    """
+    Convert the four transition matrices of a genome into a single numpy array, ordered by GENOME_MATRICES and STATES
+    :param genome: Genome object
+    :return: np.array with shape (4, len(STATES), len(STATES))
+    """
+    return np.array([[[getattr(genome, matrix)[i][j] for j in STATES] for i in STATES] for matrix in GENOME_MATRICES])
+
+
+def array_to_genome(array):
+    """
+    Inverse of genome_to_array()
+    :param array: np.array with shape (4, len(STATES), len(STATES))
+    :return: Genome object (with its array cache already filled)
+    """
+    matrices = [OrderedDict([(i, OrderedDict(zip(STATES, row))) for i, row in zip(STATES, matrix)])
+                for matrix in array.tolist()]
+    genome = Genome(*matrices)
+    genome._array = array
+    return genome
+
+
+def breed_individually(worms, world):
+    """
+    The original breeding stage, one worm at a time: each worm breeds with probability time_in_light / sum_suntan,
+    picking a mate at random from all worms in the same space (including itself).
+    :param worms: List of Worm objects
+    :param world: World object
+    :return: List of offspring
+    """
+    offspring = []
+    for worm in worms:
+        prob_breed = worm.time_in_light / world.sum_suntan
+        breed_check = rand.random()
+        if prob_breed > breed_check:
+            mates = [mate for mate in worms if (mate.x, mate.y) == (worm.x, worm.y)]
+            if mates:
+                mate = rand.choice(mates)
+                offspring.append(worm.breed(mate))
+    return offspring
+
+
+def breed_population(worms, world):
+    """
+    Vectorized equivalent of breed_individually(). Breeding probabilities and checks are computed for the whole
+    population at once, mates are picked from a single index of occupied spaces, and every offspring genome comes out
+    of one element-wise crossover. The only difference in behavior is that sum_suntan is read once at the start of
+    the stage, instead of creeping up as each offspring is born.
+    :param worms: List of Worm objects
+    :param world: World object
+    :return: List of offspring
+    """
+    if not worms:
+        return []
+    time_in_light = np.fromiter((worm.time_in_light for worm in worms), dtype=float, count=len(worms))
+    breeders = np.flatnonzero(time_in_light / world.sum_suntan > np_rand.random(len(worms)))
+    if not len(breeders):
+        return []
+
+    occupied = {}
+    for indx, worm in enumerate(worms):
+        occupied.setdefault((worm.x, worm.y), []).append(indx)
+    neighbours = [occupied[(worms[indx].x, worms[indx].y)] for indx in breeders]
+    picks = (np_rand.random(len(breeders)) * [len(group) for group in neighbours]).astype(int)
+    mates = [group[pick] for group, pick in zip(neighbours, picks)]
+
+    parents = np.array([worms[indx].genome.as_array() for indx in breeders])
+    partners = np.array([worms[indx].genome.as_array() for indx in mates])
+    children = np.where(np_rand.random(parents.shape) < 0.5, parents, partners)
+
+    offspring = []
+    for indx, genome in zip(breeders, children):
+        worm = Worm(world, array_to_genome(genome), location=rand.choice(worms[indx].adjacent_spaces()))
+        world.grid[worm.x][worm.y] = 3
+        offspring.append(worm)
+    return offspring
+
+
 def random_transition_matrix(keys):
     """
     Create a square OrderedDict of OrderedDicts, setting the values in each matrix position randomly and converting
@@ -366,6 +907,256 @@ def random_transition_matrix(keys):
     return output
 
 
+class FrameExporter(object):
+    def __init__(self, out_path, every=1, fmt="png", scale=1, workers=2, max_pending=32):
+        """
+        Write snapshots of world.grid to disk without a display. Frames are colored with `type_colors` via a lookup
+        table and handed off to a background thread pool for encoding/writing, so the simulation loop isn't blocked.
+        :param out_path: Directory for image frames, or a file for the raw video stream
+        :param every: Export a frame every N ticks
+        :param fmt: Any image extension pygame can save (png, jpg, bmp, tga), or 'raw' for a single rgb24 stream
+                    (e.g., `ffmpeg -f rawvideo -pix_fmt rgb24 -s <W>x<H> -i frames.rgb out.mp4`)
+        :param scale: Number of output pixels per grid cell
+        :param workers: Size of the writer pool (raw streams always use a single writer to keep frames in order)
+        :param max_pending: Maximum number of queued frames before the simulation waits on the writers
+        """
+        if every < 1:
+            raise ValueError("every must be a positive integer")
+        self.out_path = os.path.abspath(out_path)
+        self.every = every
+        self.fmt = fmt.lower().lstrip(".")
+        self.scale = scale
+        self.max_pending = max_pending
+        self.frame_count = 0
+        self._pending = deque()
+        if self.fmt == "raw":
+            self._stream = open(self.out_path, "wb")
+            self._pool = ThreadPoolExecutor(max_workers=1)
+        else:
+            os.makedirs(self.out_path, exist_ok=True)
+            self._stream = None
+            self._pool = ThreadPoolExecutor(max_workers=workers)
+
+    def capture(self, world, tick):
+        """
+        Queue a frame for writing if `tick` falls on the export interval
+        :param world: World object
+        :param tick: Current tick number
+        :return: True if a frame was queued
+        """
+        if tick % self.every:
+            return False
+        rgb = grid_to_rgb(world.grid, self.scale)
+        while len(self._pending) >= self.max_pending:
+            self._pending.popleft().result()
+        if self._stream:
+            self._pending.append(self._pool.submit(self._write_raw, rgb))
+        else:
+            path = os.path.join(self.out_path, "frame_%08d.%s" % (self.frame_count, self.fmt))
+            self._pending.append(self._pool.submit(self._write_image, rgb, path))
+        self.frame_count += 1
+        return True
+
+    def _write_raw(self, rgb):
+        # Grid arrays are indexed [x][y], video streams are row-major
+        self._stream.write(np.ascontiguousarray(rgb.transpose(1, 0, 2)).tobytes())
+        return
+
+    @staticmethod
+    def _write_image(rgb, path):
+        pygame.image.save(pygame.surfarray.make_surface(rgb), path)
+        return
+
+    def close(self):
+        """
+        Wait for all queued frames to be written and release the writer pool
+        :return: None
+        """
+        while self._pending:
+            self._pending.popleft().result()
+        self._pool.shutdown(wait=True)
+        if self._stream:
+            self._stream.close()
+        return
+
+
+def grid_to_rgb(grid, scale=1):
+    """
+    Vectorized conversion of a type-value grid into an RGB array, using `type_colors`
+    :param grid: world.grid
+    :param scale: Number of output pixels per grid cell
+    :return: np.array of uint8 with shape (len(grid) * scale, len(grid[0]) * scale, 3), indexed [x][y] like the grid
+    """
+    rgb = color_table[np.asarray(grid, dtype=np.intp)]
+    if scale > 1:
+        rgb = rgb.repeat(scale, axis=0).repeat(scale, axis=1)
+    return rgb
+
+
+class SharedState(object):
+    # Header slots (int64)
+    SEQUENCE, TICK, POP_SIZE, COUNT, CAPACITY, GRID_SIDE, GENOMES_SEQUENCE = range(7)
+    HEADER_LEN = 8
+    _attach_lock = threading.Lock()
+
+    def __init__(self, name=None, grid_side=None, capacity=None):
+        """
+        Population arrays and world.grid in a single multiprocessing.shared_memory block, so other processes (viewers,
+        statistics collectors, recorders) can map the live simulation without anything being pickled.
+        Pass grid_side and capacity to create a new block (the writer); pass only a name to attach to one (a reader).
+
+        Consistency uses a sequence lock: the writer makes the sequence counter odd before it starts a publish() and
+        even again when it is done, so the simulation never waits on readers. Readers either take a checked copy with
+        read(), or use the zero-copy arrays directly and confirm `sequence` hasn't changed afterwards. Genomes are only
+        current if the last publish wrote them (see `genomes_current`).
+        :param name: Shared memory block name. Default is a random name when creating.
+        :param grid_side: Length of a side of world.grid
+        :param capacity: Maximum number of worms to publish (any beyond that are left out, see `count` vs `pop_size`)
+        """
+        self.owner = grid_side is not None
+        if self.owner:
+            if not capacity or capacity < 1:
+                raise ValueError("capacity must be a positive integer")
+            size = self._layout(grid_side, capacity)[1]
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            header = np.ndarray((self.HEADER_LEN,), dtype=np.int64, buffer=self.shm.buf)
+            header[:] = 0
+            header[self.CAPACITY] = capacity
+            header[self.GRID_SIDE] = grid_side
+        else:
+            try:
+                self.shm = shared_memory.SharedMemory(name=name, track=False)
+            except TypeError:
+                self.shm = self._attach_untracked(name)
+            header = np.ndarray((self.HEADER_LEN,), dtype=np.int64, buffer=self.shm.buf)
+            grid_side, capacity = int(header[self.GRID_SIDE]), int(header[self.CAPACITY])
+
+        self.name = self.shm.name
+        self.capacity = capacity
+        self.arrays = OrderedDict()
+        for key, (dtype, shape, offset) in self._layout(grid_side, capacity)[0].items():
+            self.arrays[key] = np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=offset)
+        self.header = self.arrays["header"]
+
+    @classmethod
+    def _attach_untracked(cls, name):
+        """
+        Python < 3.13 registers attached blocks with the resource tracker, which then unlinks them when the reader
+        exits. Unregistering afterwards isn't safe either: readers started with spawn or forkserver share the owner's
+        tracker, which only holds one entry per block, so that would remove the owner's registration. Instead, stop
+        the attach from registering at all.
+        :param name: Shared memory block name
+        :return: SharedMemory
+        """
+        register = resource_tracker.register
+
+        def skip_shared_memory(rname, rtype):
+            if rtype != "shared_memory":
+                register(rname, rtype)
+
+        with cls._attach_lock:
+            resource_tracker.register = skip_shared_memory
+            try:
+                return shared_memory.SharedMemory(name=name)
+            finally:
+                resource_tracker.register = register
+
+    @classmethod
+    def _layout(cls, grid_side, capacity):
+        """
+        :return: (OrderedDict of array name -> (dtype, shape, byte offset), total bytes)
+        """
+        fields = [("header", np.int64, (cls.HEADER_LEN,)), ("grid", np.uint8, (grid_side, grid_side)),
+                  ("x", np.int32, (capacity,)), ("y", np.int32, (capacity,)),
+                  ("direction", np.int8, (capacity,)), ("state", np.int8, (capacity,)),
+                  ("age", np.int32, (capacity,)), ("food", np.int32, (capacity,)),
+                  ("time_in_light", np.int32, (capacity,)),
+                  ("genome", np.float64, (capacity, len(GENOME_MATRICES), len(STATES), len(STATES)))]
+        layout = OrderedDict()
+        offset = 0
+        for key, dtype, shape in fields:
+            layout[key] = (dtype, shape, offset)
+            offset += int(np.prod(shape)) * np.dtype(dtype).itemsize
+            offset += -offset % 8  # Keep every array 8-byte aligned
+        return layout, offset
+
+    @property
+    def sequence(self):
+        return int(self.header[self.SEQUENCE])
+
+    @property
+    def genomes_current(self):
+        """
+        :return: True if the genome array was written by the latest publish(), False if it holds older genomes
+        """
+        return int(self.header[self.GENOMES_SEQUENCE]) == self.sequence
+
+    def publish(self, world, worms, tick, genomes=True):
+        """
+        Copy the current state of the simulation into shared memory
+        :param world: World object
+        :param worms: List of Worm objects
+        :param tick: Current tick number
+        :param genomes: Also copy every genome (the most expensive part, so it can be skipped). If skipped, readers
+        are told the genome array is stale.
+        :return: None
+        """
+        arrays = self.arrays
+        count = min(len(worms), self.capacity)
+        published = worms[:count]
+        self.header[self.SEQUENCE] += 1
+        arrays["grid"][:] = world.grid
+        for key in ["x", "y", "direction", "age", "food", "time_in_light"]:
+            arrays[key][:count] = [getattr(worm, key) for worm in published]
+        arrays["state"][:count] = [STATE_INDEX[worm.state] for worm in published]
+        if genomes and count:
+            arrays["genome"][:count] = [worm.genome.as_array() for worm in published]
+        if genomes:
+            self.header[self.GENOMES_SEQUENCE] = self.header[self.SEQUENCE] + 1
+        self.header[self.TICK] = tick
+        self.header[self.POP_SIZE] = world.pop_size
+        self.header[self.COUNT] = count
+        self.header[self.SEQUENCE] += 1
+        return
+
+    def read(self, retries=1000):
+        """
+        Take a consistent copy of the latest published state
+        :param retries: How many times to try before giving up on catching the writer between publishes
+        :return: OrderedDict of tick, pop_size, grid and the population arrays (trimmed to the published worms).
+        'genome' is left out if the latest publish skipped genomes.
+        """
+        for _ in range(retries):
+            sequence = self.sequence
+            if sequence % 2:
+                time.sleep(0)
+                continue
+            count = int(self.header[self.COUNT])
+            snapshot = OrderedDict([("tick", int(self.header[self.TICK])),
+                                    ("pop_size", int(self.header[self.POP_SIZE]))])
+            genomes_current = int(self.header[self.GENOMES_SEQUENCE]) == sequence
+            for key, array in self.arrays.items():
+                if key == "grid":
+                    snapshot[key] = array.copy()
+                elif key != "header" and (key != "genome" or genomes_current):
+                    snapshot[key] = array[:count].copy()
+            if self.sequence == sequence:
+                return snapshot
+        raise RuntimeError("Unable to read a consistent snapshot from shared memory '%s'" % self.name)
+
+    def close(self):
+        """
+        Detach from the shared memory block, and remove it entirely if this is the process that created it
+        :return: None
+        """
+        self.arrays = OrderedDict()
+        self.header = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+        return
+
+
 def event_handler():
     # This is the primary listener logic, it catches all types of input
     for event in pygame.event.get():
@@ -380,52 +1171,75 @@ def draw_pixel(x, y, type_val, scale=10):
     return
 
 
-def main(len_side, pixel_size, starting_pop_size):
+def seed(value):
+    """
+    Seed every random number generator used by the simulation, so runs can be reproduced exactly
+    :param value: Integer seed
+    :return: None
+    """
+    global np_rand
+    rand.seed(value)
+    np_rand = np.random.default_rng(value)
+    return
+
+
+def setup_world(len_side, pixel_size, starting_pop_size, light_schedule=None):
+    """
+    Build a world and populate it with randomly generated worms
+    :param len_side: The length of a side as passed into PyGame
+    :param pixel_size: How many side units are contained in a single 'pixel' in the actual grid
+    :param starting_pop_size: Number of worms to start with (also the mean population size from then on)
+    :param light_schedule: LightField schedule. Default is darkness.
+    :return: (World, [Worm, ...])
+    """
     if len_side % pixel_size:
         raise ValueError("len_side is not divisible by pixel_size")
-    pix_per_side = int(len_side / pixel_size)
     world = World(len_side, pixel_size)
-    world.light_spots = {tup: None for tup in define_circle_edges(10, 1, 20, 20, fill=True)}
-    world.light_spots = {}
+    if light_schedule:
+        world.light_field = LightField(int(len_side / pixel_size), light_schedule)
+        world.light_field.precompute()
+        world.update_light(0)
     worms = [Worm(world, Genome()) for _ in range(starting_pop_size)]
-    printer = br.DynamicPrint()
-    print("Pop size    Sum eaten    Sum suntan    Num food spots")
+    return world, worms
+
+
+def simulate(world, worms, starting_pop_size, breeder=breed_population):
+    """
+    Run the simulation, one tick per iteration. Nothing here touches the display, so the same loop drives interactive,
+    headless and batch runs.
+    :param world: World object
+    :param worms: List of Worm objects. Modified in place, so it always holds the current population.
+    :param starting_pop_size: Mean of the poisson distribution that caps the population each tick
+    :param breeder: Breeding stage, breed_population() or breed_individually()
+    :return: Generator yielding the tick number at the end of each tick
+    """
+    pix_per_side = len(world.grid)
+    tick = 0
     while True:
-        event_handler()
+        world.update_light(tick)
         world.scatter_food(10)
         for i in range(pix_per_side):
             for j in range(pix_per_side):
-                i *= pixel_size
-                j *= pixel_size
                 if (i, j) in world.dish_edges:
                     world.grid[i][j] = 0
-                elif (i, j) in world.light_spots:
+                elif world.light[i, j]:
                     world.grid[i][j] = 2
                 elif (i, j) in world.food_locations:
                     world.grid[i][j] = 4
                 else:
                     world.grid[i][j] = 1
         # Sorting. Younger worms have greater initiative
-        worms = sorted(worms, key=lambda x: x.age)
+        worms.sort(key=lambda x: x.age)
 
         # Movement
         for worm in worms:
             worm.step()
 
         # Breeding
-        offspring = []
-        for worm in worms:
-            prob_breed = worm.time_in_light / world.sum_suntan
-            breed_check = rand.random()
-            if prob_breed > breed_check:
-                mates = [mate for mate in worms if (mate.x, mate.y) == (worm.x, worm.y)]
-                if mates:
-                    mate = rand.choice(mates)
-                    offspring.append(worm.breed(mate))
-        worms += offspring
+        worms += breeder(worms, world)
 
         # Killing: Each cycle, set the max population size by drawing from a poisson distribution with mu = 1000
-        max_pop_size = poisson.rvs(starting_pop_size)
+        max_pop_size = poisson.rvs(starting_pop_size, random_state=np_rand)
         number_deaths = world.pop_size - max_pop_size if max_pop_size < world.pop_size else 0
 
         # More food and younger age gives an advantage, so find relative amount of food eaten and subtract it from 1
@@ -438,21 +1252,81 @@ def main(len_side, pixel_size, starting_pop_size):
         for indx in sorted(death_row, reverse=True):
             world.sum_food_eaten -= worms[indx].food
             world.sum_suntan -= worms[indx].time_in_light
+            world.analytics.remove(worms[indx])
             del worms[indx]
         world.pop_size -= len(death_row)
+        world.analytics.record(tick)
+        yield tick
+        tick += 1
+
+
+def main(len_side, pixel_size, starting_pop_size, analytics_file=None, headless=False, frame_exporter=None,
+         light_schedule=None, monitor=None, breeder=breed_population, shared_state=None, analytics_every=1):
+    world, worms = setup_world(len_side, pixel_size, starting_pop_size, light_schedule)
+    world.analytics.record_every = analytics_every
+    if analytics_file:
+        # Rows are appended to the spool as the run goes, and only packed into the archive once at the end
+        world.analytics.spool_dir = "%s.spool" % analytics_file
+        if os.path.isdir(world.analytics.spool_dir):
+            shutil.rmtree(world.analytics.spool_dir)
+    printer = br.DynamicPrint()
+    print("Pop size    Sum eaten    Sum suntan    Num food spots")
+    for tick in simulate(world, worms, starting_pop_size, breeder):
+        event_handler()
+
+        if frame_exporter:
+            frame_exporter.capture(world, tick)
+
+        if shared_state:
+            shared_state.publish(world, worms, tick)
 
         # Draw world
-        for indx_i, i in enumerate(world.grid):
-            for indx_j, j in enumerate(i):
-                draw_pixel(indx_i, indx_j, j)
+        if not headless:
+            for indx_i, i in enumerate(world.grid):
+                for indx_j, j in enumerate(i):
+                    draw_pixel(indx_i, indx_j, j)
 
         output = "{:<12}{:<13}{:<14}{:<17}".format(world.pop_size, world.sum_food_eaten,
                                                    world.sum_suntan, len(world.food_locations))
         printer.write(output)
-        pygame.display.update()
+        if not headless:
+            pygame.display.update()
+
+        if monitor and monitor.update(world, tick):
+            break
+
+    report = monitor.report(world)
+    print("\n\nStopped (%s) after %s ticks" % (report["reason"], report["ticks"]))
+    print("\n".join("{:<16}{}".format(key, val) for key, val in report.items()))
+    if analytics_file:
+        world.analytics.save(analytics_file, **OrderedDict([("final_%s" % key, val) for key, val in report.items()]))
+        shutil.rmtree(world.analytics.spool_dir, ignore_errors=True)
+    return report
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog="phototaxis", description="Evolving a preference for light")
+    parser.add_argument("--headless", action="store_true", help="Run without opening a display")
+    parser.add_argument("--frames", metavar="PATH",
+                        help="Export frames to a directory (or a file with --frame_fmt raw)")
+    parser.add_argument("--frame_every", type=int, default=1, metavar="N", help="Export a frame every N ticks")
+    parser.add_argument("--frame_fmt", default="png", help="Image format for exported frames, or 'raw' (rgb24)")
+    parser.add_argument("--frame_scale", type=int, default=1, help="Output pixels per grid cell")
+    parser.add_argument("--analytics", metavar="FILE", help="Save population analytics to an .npz archive")
+    parser.add_argument("--analytics_every", type=int, default=1, metavar="N",
+                        help="Only record analytics every N ticks")
+    parser.add_argument("--max_ticks", type=int, help="Stop after this many ticks")
+    parser.add_argument("--max_seconds", type=float, help="Stop after this much wall time")
+    parser.add_argument("--window", type=int, default=500, help="Ticks to look back over when testing convergence")
+    parser.add_argument("--tolerance", type=float, default=0.05,
+                        help="Relative variation allowed in suntan and food over the window for convergence")
+    parser.add_argument("--shared_memory", metavar="NAME", help="Publish live state to a shared memory block")
+    parser.add_argument("--light", nargs=3, type=float, action="append", metavar=("X", "Y", "RADIUS"),
+                        help="Add a static spot of light (can be used multiple times)")
+    in_args = parser.parse_args()
+
+    if in_args.headless:
+        os.environ["SDL_VIDEODRIVER"] = "dummy"
     pygame.init()
 
     display_width = 1000
@@ -462,4 +1336,18 @@ if __name__ == '__main__':
     game_display.fill((255, 255, 255))
     pygame.display.set_caption('Phototaxis Simulation')
 
-    main(len_side=100, pixel_size=1, starting_pop_size=1000)
+    exporter = FrameExporter(in_args.frames, every=in_args.frame_every, fmt=in_args.frame_fmt,
+                             scale=in_args.frame_scale) if in_args.frames else None
+    shared = SharedState(in_args.shared_memory, grid_side=100, capacity=2000) if in_args.shared_memory else None
+    try:
+        light = [(1, [LightSpot(*spot) for spot in in_args.light])] if in_args.light else None
+        stopper = ConvergenceMonitor(window=in_args.window, tolerance=in_args.tolerance,
+                                     max_ticks=in_args.max_ticks, max_seconds=in_args.max_seconds)
+        main(len_side=100, pixel_size=1, starting_pop_size=1000, analytics_file=in_args.analytics,
+             headless=in_args.headless, frame_exporter=exporter, light_schedule=light, monitor=stopper,
+             shared_state=shared, analytics_every=in_args.analytics_every)
+    finally:
+        if exporter:
+            exporter.close()
+        if shared:
+            shared.close()
@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""
+Local run server: submit simulation jobs, watch their per-tick stats stream back, and cancel them.
+
+The protocol is newline-delimited JSON over TCP. Each request is one object with a 'cmd' key:
+    {"cmd": "submit", "config": {...}, "watch": true}  ->  {"job": 1, "status": "queued"}, then stats if watching
+    {"cmd": "watch", "job": 1}                         ->  {"job": 1, "tick": 0, ...} per tick, then a final status
+    {"cmd": "cancel", "job": 1}                        ->  {"job": 1, "status": "cancelling"}
+    {"cmd": "status"}                                  ->  {"jobs": [{"job": 1, "status": "running", ...}, ...]}
+A final status message looks like {"job": 1, "status": "done", "report": {...}} (or "cancelled"/"failed").
+Cancelling a running job only asks it to stop, so it may still finish as "done"; queued jobs are "cancelled" straight
+away, and finished jobs keep their status.
+"""
+import json
+import asyncio
+import argparse
+import functools
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import phototaxis
+
+DEFAULT_CONFIG = OrderedDict([("len_side", 100), ("pixel_size", 1), ("pop_size", 1000), ("ticks", 1000),
+                              ("seed", None), ("light", None), ("light_schedule", None), ("window", 500),
+                              ("tolerance", 0.05), ("stats_every", 1)])
+FINISHED = ["done", "cancelled", "failed"]
+
+
+def make_config(config):
+    """
+    Fill in defaults and reject anything that isn't a known setting
+    :param config: dict of settings from a client
+    :return: OrderedDict
+    """
+    unknown = set(config) - set(DEFAULT_CONFIG)
+    if unknown:
+        raise ValueError("Unknown config settings: %s" % ", ".join(sorted(unknown)))
+    full_config = OrderedDict(DEFAULT_CONFIG)
+    full_config.update(config)
+    if full_config["len_side"] < 1 or full_config["pixel_size"] < 1:
+        raise ValueError("len_side and pixel_size must be positive integers")
+    if full_config["len_side"] % full_config["pixel_size"]:
+        raise ValueError("len_side is not divisible by pixel_size")
+    if full_config["ticks"] < 1 or full_config["stats_every"] < 1:
+        raise ValueError("ticks and stats_every must be positive integers")
+    return full_config
+
+
+def light_schedule(config):
+    """
+    Build a LightField schedule from a config. 'light' is a list of spots that are always on, 'light_schedule' is a
+    list of [duration, [spot, ...]] phases. Spots are either [x, y, radius] lists or dicts of LightSpot arguments.
+    :param config: Output of make_config()
+    :return: Schedule, or None for darkness
+    """
+    def spot(spec):
+        return phototaxis.LightSpot(**spec) if isinstance(spec, dict) else phototaxis.LightSpot(*spec)
+
+    if config["light_schedule"]:
+        return [(duration, [spot(spec) for spec in spots]) for duration, spots in config["light_schedule"]]
+    if config["light"]:
+        return [(1, [spot(spec) for spec in config["light"]])]
+    return None
+
+
+def warm_up(sizes):
+    """
+    Worker initializer. Imports are already paid for by the time this runs, so just build the dish geometry for the
+    usual world sizes.
+    :param sizes: List of (len_side, pixel_size)
+    :return: None
+    """
+    for len_side, pixel_size in sizes:
+        phototaxis.dish_geometry(len_side, pixel_size)
+    return
+
+
+def run_job(job_id, config, updates, cancelled):
+    """
+    Run one simulation in a worker process, sending stats back through the `updates` queue
+    :param job_id: Job number
+    :param config: Output of make_config()
+    :param updates: Manager queue shared by every job, messages are (job_id, dict)
+    :param cancelled: Manager dict of job ids that should stop
+    :return: Report dict (see phototaxis.ConvergenceMonitor.report()), or None if cancelled before starting
+    """
+    if job_id in cancelled:
+        return None
+    updates.put((job_id, {"status": "running"}))
+    try:
+        if config["seed"] is not None:
+            phototaxis.seed(config["seed"])
+        pop_size = config["pop_size"]
+        world, worms = phototaxis.setup_world(config["len_side"], config["pixel_size"], pop_size,
+                                              light_schedule(config))
+        monitor = phototaxis.ConvergenceMonitor(window=config["window"], tolerance=config["tolerance"],
+                                                max_ticks=config["ticks"])
+        for tick in phototaxis.simulate(world, worms, pop_size):
+            stop = monitor.update(world, tick)
+            if not tick % config["stats_every"] or stop:
+                updates.put((job_id, OrderedDict([("tick", tick), ("pop_size", world.pop_size),
+                                                  ("sum_food_eaten", world.sum_food_eaten),
+                                                  ("sum_suntan", world.sum_suntan),
+                                                  ("food_spots", len(world.food_locations)),
+                                                  ("light_fraction",
+                                                   world.analytics.last_light_fraction),
+                                                  ("diversity", world.analytics.diversity())])))
+            if stop:
+                break
+            if job_id in cancelled:
+                monitor.reason = "cancelled"
+                break
+        return dict(monitor.report(world))
+    finally:
+        # The queue is FIFO, so once this arrives every stat from the job has been delivered
+        updates.put((job_id, {"status": "finished"}))
+
+
+class Job(object):
+    def __init__(self, job_id, config):
+        self.id = job_id
+        self.config = config
+        self.status = "queued"
+        self.future = None  # asyncio wrapper around executor_future
+        self.executor_future = None
+        self.last_stats = None
+        self.report = None
+        self.error = None
+        self.watchers = []  # asyncio.Queue per watching client
+        self.drained = asyncio.Event()  # Every stat from the worker has been passed on
+        self.finished = asyncio.Event()
+
+    def summary(self):
+        return OrderedDict([("job", self.id), ("status", self.status), ("config", self.config),
+                            ("last_stats", self.last_stats), ("report", self.report), ("error", self.error)])
+
+    def final_message(self):
+        message = OrderedDict([("job", self.id), ("status", self.status)])
+        if self.report:
+            message["report"] = self.report
+        if self.error:
+            message["error"] = self.error
+        return message
+
+    def notify(self, message):
+        for queue in self.watchers:
+            queue.put_nowait(message)
+        return
+
+
+class RunServer(object):
+    def __init__(self, host="127.0.0.1", port=8765, workers=2, warm_sizes=((100, 1),)):
+        """
+        Asyncio front end over a bounded pool of worker processes. Workers live for the life of the server, so each
+        one only pays for imports and dish geometry once.
+        :param host: Interface to listen on
+        :param port: Port to listen on (0 picks a free one, see `port` after start())
+        :param workers: Maximum number of simulations running at once. Anything beyond that waits in the queue.
+        :param warm_sizes: (len_side, pixel_size) pairs to build dish geometry for as each worker starts
+        """
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.warm_sizes = list(warm_sizes)
+        self.jobs = OrderedDict()
+        self.manager = None
+        self.updates = None
+        self.cancelled = None
+        self.pool = None
+        self.server = None
+        self._pump = None
+
+    async def start(self):
+        # Forked workers would inherit open client sockets (so clients never see the connection close), so start
+        # every process from a clean fork server instead
+        context = multiprocessing.get_context("forkserver")
+        self.manager = context.Manager()
+        self.updates = self.manager.Queue()
+        self.cancelled = self.manager.dict()
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context, initializer=warm_up,
+                                        initargs=(self.warm_sizes,))
+        # Bring every worker up now, rather than making the first jobs wait on imports
+        loop = asyncio.get_event_loop()
+        await asyncio.gather(*[loop.run_in_executor(self.pool, warm_up, []) for _ in range(self.workers)])
+        self._pump = asyncio.ensure_future(self.pump_updates())
+        self.server = await asyncio.start_server(self.handle_client, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return
+
+    async def close(self):
+        try:
+            self.server.close()
+            await self.server.wait_closed()
+            for job in self.jobs.values():
+                if job.status not in FINISHED:
+                    self.cancel(job.id)
+            # Waiting on the pool blocks, so keep it off the event loop (the pump still has stats to deliver meanwhile)
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(None, functools.partial(self.pool.shutdown, wait=True, cancel_futures=True))
+            unfinished = [asyncio.ensure_future(job.finished.wait()) for job in self.jobs.values()
+                          if not job.finished.is_set()]
+            if unfinished:
+                await asyncio.wait(unfinished, timeout=10)
+        finally:
+            # The pump thread is blocked on the queue until it gets the sentinel, and asyncio.run() waits on it
+            self.updates.put(None)
+            await self._pump
+            self.manager.shutdown()
+        return
+
+    async def pump_updates(self):
+        """
+        Move stats from the worker processes to whoever is watching each job
+        :return: None
+        """
+        loop = asyncio.get_event_loop()
+        while True:
+            update = await loop.run_in_executor(None, self.updates.get)
+            if update is None:
+                return
+            job_id, message = update
+            job = self.jobs[job_id]
+            if message.get("status") == "finished":
+                job.drained.set()
+                continue
+            if "status" in message:
+                if job.status == "queued":
+                    job.status = message["status"]
+                continue
+            job.last_stats = message
+            job.notify(OrderedDict([("job", job_id)] + list(message.items())))
+
+    def submit(self, config):
+        """
+        Queue a new simulation
+        :param config: dict of settings (see DEFAULT_CONFIG)
+        :return: Job object
+        """
+        job = Job(len(self.jobs) + 1, make_config(config))
+        self.jobs[job.id] = job
+        job.executor_future = self.pool.submit(run_job, job.id, job.config, self.updates, self.cancelled)
+        job.future = asyncio.wrap_future(job.executor_future)
+        job.future.add_done_callback(lambda future: asyncio.ensure_future(self._finish(job)))
+        return job
+
+    async def _finish(self, job):
+        if job.future.cancelled():
+            job.status = "cancelled"
+        else:
+            try:
+                job.report = job.future.result()
+                job.status = "cancelled" if job.report is None or job.report["reason"] == "cancelled" else "done"
+            except Exception as err:
+                job.status = "failed"
+                job.error = "%s: %s" % (type(err).__name__, err)
+            if job.report is not None or job.error:
+                # Don't send the final message ahead of stats still on their way through the pump (unless the worker
+                # died without saying goodbye)
+                try:
+                    await asyncio.wait_for(job.drained.wait(), 5)
+                except asyncio.TimeoutError:
+                    pass
+        job.notify(job.final_message())
+        job.finished.set()
+        return
+
+    def cancel(self, job_id):
+        """
+        Stop a job. Queued jobs never start; running jobs stop at the end of their current tick.
+        :param job_id: Job number
+        :return: (Job object, status to report: the final status if the job is already over, "cancelled" if it never
+                 started, otherwise "cancelling")
+        """
+        job = self.jobs[job_id]
+        if job.status not in FINISHED:
+            self.cancelled[job_id] = True
+            # Only succeeds if no worker has picked the job up yet. Otherwise the worker sees the cancelled flag (before
+            # its first tick at the latest) and reports back like any other finished job.
+            if job.executor_future.cancel():
+                return job, "cancelled"
+            return job, "cancelling"
+        return job, job.status
+
+    async def watch(self, job, writer):
+        """
+        Stream stats for a job to a client until it finishes
+        :param job: Job object
+        :param writer: asyncio.StreamWriter
+        :return: None
+        """
+        if job.finished.is_set():
+            await send(writer, job.final_message())
+            return
+        queue = asyncio.Queue()
+        job.watchers.append(queue)
+        try:
+            while True:
+                message = await queue.get()
+                await send(writer, message)
+                if message.get("status") in FINISHED:
+                    return
+        finally:
+            job.watchers.remove(queue)
+
+    async def handle_client(self, reader, writer):
+        watching = []
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    cmd = request["cmd"]
+                    if cmd == "submit":
+                        job = self.submit(request.get("config", {}))
+                        await send(writer, OrderedDict([("job", job.id), ("status", job.status)]))
+                        if request.get("watch"):
+                            watching.append(asyncio.ensure_future(self.watch(job, writer)))
+                    elif cmd == "watch":
+                        watching.append(asyncio.ensure_future(self.watch(self.jobs[request["job"]], writer)))
+                    elif cmd == "cancel":
+                        job, status = self.cancel(request["job"])
+                        await send(writer, OrderedDict([("job", job.id), ("status", status)]))
+                    elif cmd == "status":
+                        await send(writer, {"jobs": [job.summary() for job in self.jobs.values()]})
+                    else:
+                        raise ValueError("Unknown command '%s'" % cmd)
+                except (ValueError, KeyError, TypeError) as err:
+                    await send(writer, {"error": "%s: %s" % (type(err).__name__, err)})
+            # The client has stopped sending, but may still be waiting on streams
+            if watching:
+                await asyncio.gather(*watching)
+        except ConnectionError:
+            pass
+        finally:
+            for task in watching:
+                task.cancel()
+            writer.close()
+        return
+
+
+async def send(writer, message):
+    writer.write((json.dumps(message, default=float) + "\n").encode())
+    await writer.drain()
+    return
+
+
+async def request(message, host="127.0.0.1", port=8765):
+    """
+    Minimal client: send one request and yield every response until the server has nothing more to say
+    :param message: dict, one protocol request
+    :param host: Server address
+    :param port: Server port
+    :return: Async generator of response dicts
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.write((json.dumps(message) + "\n").encode())
+        await writer.drain()
+        writer.write_eof()
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            yield json.loads(line)
+    finally:
+        writer.close()
+
+
+async def serve(host, port, workers):
+    server = RunServer(host, port, workers)
+    await server.start()
+    print("Phototaxis run server listening on %s:%s with %s workers" % (host, server.port, workers))
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog="server", description="Local service for queuing phototaxis runs")
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to listen on")
+    parser.add_argument("--port", type=int, default=8765, help="Port to listen on")
+    parser.add_argument("--workers", type=int, default=2, help="Maximum number of simultaneous runs")
+    in_args = parser.parse_args()
+    try:
+        asyncio.run(serve(in_args.host, in_args.port, in_args.workers))
+    except KeyboardInterrupt:
+        pass
@@ -3,6 +3,7 @@
 """ Fixtures for py.test  """
 import pytest
 import types
+import numpy as np
 from collections import OrderedDict
 from copy import copy
 import phototaxis
@@ -15,7 +16,7 @@ class HelperObjects(object):
     @staticmethod
     def world():
         world_obj = types.SimpleNamespace()
-        world_obj.grid = [[None for _ in range(4)] for _ in range(4)]
+        world_obj.grid = [[0 for _ in range(4)] for _ in range(4)]
         world_obj.dish_edges = {(0, 1): None, (0, 2): None, (0, 3): None, (1, 0): None,
                                 (1, 4): None, (2, 0): None, (2, 4): None, (3, 0): None,
                                 (3, 4): None, (4, 1): None, (4, 2): None, (4, 3): None}
@@ -23,8 +24,10 @@ class HelperObjects(object):
                                   (2, 1): None, (2, 2): None, (2, 3): None,
                                   (3, 1): None, (3, 2): None, (3, 3): None}
 
-        world_obj.light_spots = {(1, 1): None, (1, 2): None}
+        world_obj.light = np.zeros((5, 5))
+        world_obj.light[1, 1] = world_obj.light[1, 2] = 1
         world_obj.food_locations = {(2, 2): None, (3, 2): None}
+        world_obj.analytics = phototaxis.Analytics()
         world_obj.pop_size = 0
         world_obj.sum_food_eaten = 0
         world_obj.sum_suntan = 0
@@ -39,6 +42,7 @@ class HelperObjects(object):
         genome_obj.p_light = copy(trans_mat)
         genome_obj.p_dark_wall = copy(trans_mat)
         genome_obj.p_light_wall = copy(trans_mat)
+        genome_obj.as_array = lambda: phototaxis.genome_to_array(genome_obj)
         return genome_obj
 
     def worm(self):
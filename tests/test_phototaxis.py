@@ -1,4 +1,7 @@
+import os
 import pytest
+import multiprocessing
+import numpy as np
 import phototaxis
 from random import Random
 from collections import OrderedDict
@@ -74,10 +77,25 @@ def test_define_circle_edges():
                              (4, 1), (4, 2), (4, 3)]
 
 
+def test_dish_geometry(monkeypatch):
+    monkeypatch.setattr(phototaxis, "dish_cache", {})
+    edges, surface = phototaxis.dish_geometry(5, 1)
+    assert sorted(edges) == sorted(phototaxis.define_circle_edges(5, 1))
+    assert sorted(surface) == [(1, 1), (1, 2), (1, 3), (2, 1), (2, 2), (2, 3), (3, 1), (3, 2), (3, 3)]
+    assert list(phototaxis.dish_cache) == [(5, 1)]
+
+    monkeypatch.setattr(phototaxis, "define_circle_edges", lambda *_, **__: 1 / 0)  # Must come from the cache
+    edges2, surface2 = phototaxis.dish_geometry(5, 1)
+    assert edges2 == edges and surface2 == surface
+    del surface2[(2, 2)]
+    assert (2, 2) in phototaxis.dish_geometry(5, 1)[1]
+
+
 def test_world_init(monkeypatch):
     monkeypatch.setattr(phototaxis, "define_circle_edges", mock_define_circle_edges)
+    monkeypatch.setattr(phototaxis, "dish_cache", {})
     world = phototaxis.World(2, 1)
-    assert world.grid == [[None, None], [None, None]]
+    assert world.grid == [[0, 0], [0, 0]]
 
     assert world.dish_edges == {(0, 1): None, (0, 2): None, (0, 3): None, (1, 0): None,
                                 (1, 4): None, (2, 0): None, (2, 4): None, (3, 0): None,
@@ -85,7 +103,9 @@ def test_world_init(monkeypatch):
     assert world.dish_surface == {(1, 1): None, (1, 2): None, (1, 3): None,
                                   (2, 1): None, (2, 2): None, (2, 3): None,
                                   (3, 1): None, (3, 2): None, (3, 3): None}
-    assert world.light_spots == {}
+    assert world.light.shape == (2, 2)
+    assert not world.light.any()
+    assert world.analytics.count == 0
     assert world.pop_size == 0
     assert world.sum_food_eaten == 0
     assert world.sum_suntan == 0
@@ -99,6 +119,73 @@ def test_world_scatter_food(ho, monkeypatch):
     world.scatter_food(world, 1)
     assert world.food_locations == {(2, 2): None, (3, 2): None, (1, 2): None}
 
+
+def test_world_update_light(ho):
+    world = ho.world()
+    world.update_light = phototaxis.World.update_light
+    world.light_field = phototaxis.LightField(5, [(2, []), (1, [phototaxis.LightSpot(2, 2, 0)])])
+    world.update_light(world, 0)
+    assert not world.light.any()
+    world.update_light(world, 2)
+    assert world.light[2, 2] == 1
+    assert world.light.sum() == 1
+
+
+def test_light_spot():
+    spot = phototaxis.LightSpot(1, 2, 1, velocity=(1, -1))
+    assert spot.position(0, 5) == (1, 2)
+    assert spot.position(3, 5) == (4, 4)
+
+    mask = np.zeros((5, 5))
+    spot.render(mask, 2, 2)
+    assert sorted(zip(*np.nonzero(mask))) == [(1, 2), (2, 1), (2, 2), (2, 3), (3, 2)]
+
+    spot = phototaxis.LightSpot(2, 2, 1, intensity=0.5, gradient=True)
+    spot.render(mask, 2, 2)
+    assert mask[2, 2] == 1
+    assert mask[0, 2] == 0
+    spot.render(mask, 0, 0)
+    assert mask[0, 0] == 0.5
+    assert mask[1, 0] == 0.25
+    assert mask[4, 0] == mask[0, 4] == 0.25  # Wrapped around the edges
+
+    mask = np.zeros((5, 5))
+    phototaxis.LightSpot(0, 0, 1).render(mask, 4, 2)
+    assert sorted(zip(*np.nonzero(mask))) == [(0, 2), (3, 2), (4, 1), (4, 2), (4, 3)]
+
+    with pytest.raises(ValueError) as err:
+        phototaxis.LightSpot(2, 2, 1, intensity=2)
+    assert "Light intensity must be between 0 and 1" in str(err)
+
+
+def test_light_field():
+    field = phototaxis.LightField(5)
+    assert not field.mask(0).any()
+    assert field.mask(10) is field.mask(0)
+
+    static = phototaxis.LightSpot(1, 1, 0)
+    moving = phototaxis.LightSpot(0, 4, 0, velocity=(1, 0))
+    field = phototaxis.LightField(5, [(2, [static]), (1, []), (3, [static, moving])], cache_size=3)
+    assert field.period == 6
+    assert [field.phase(tick) for tick in range(8)] == [0, 0, 1, 2, 2, 2, 0, 0]
+
+    field.precompute()
+    assert len(field.cache) == 2
+    assert field.mask(1)[1, 1] == 1
+    assert not field.mask(2).any()
+    assert sorted(zip(*np.nonzero(field.mask(3)))) == [(1, 1), (3, 4)]
+    assert sorted(zip(*np.nonzero(field.mask(4)))) == [(1, 1), (4, 4)]
+    assert len(field.cache) == 3
+    assert (2, ((1, 1), (3, 4))) in field.cache
+    assert (0, ((1, 1),)) not in field.cache  # Evicted
+    with pytest.raises(ValueError):
+        field.mask(3)[0, 0] = 1
+
+    with pytest.raises(ValueError) as err:
+        phototaxis.LightField(5, [(0, [])])
+    assert "Light phases must last at least one tick" in str(err)
+
+
 def test_genome_init(monkeypatch):
     monkeypatch.setattr(phototaxis, "random_transition_matrix", lambda *_, **__: "foo")
     genome = phototaxis.Genome("Foo", "Bar", "Baz", "Bof")
@@ -114,6 +201,186 @@ def test_genome_init(monkeypatch):
     assert genome.p_light_wall == "foo"
 
 
+def test_genome_as_array(ho):
+    genome = ho.genome()
+    genome.as_array = phototaxis.Genome.as_array
+    genome._array = None
+    array = genome.as_array(genome)
+    assert array.shape == (4, 5, 5)
+    assert array[0][0][0] == 1 / 15
+    assert array[3][4][4] == 5 / 15
+    assert genome.as_array(genome) is array
+
+
+def test_analytics(ho):
+    analytics = phototaxis.Analytics()
+    assert analytics.diversity() == 0
+    assert analytics.light_fraction() == 0
+
+    worm1, worm2, worm3 = ho.worm(), ho.worm(), ho.worm()
+    worm2.genome.p_dark = OrderedDict([(i, OrderedDict([(j, 0.2) for j in phototaxis.STATES]))
+                                       for i in phototaxis.STATES])
+    worm3.genome.p_dark = OrderedDict([(i, OrderedDict([(j, 0.8) for j in phototaxis.STATES]))
+                                       for i in phototaxis.STATES])
+    for worm in [worm1, worm2, worm3]:
+        analytics.add(worm)
+    arrays = [phototaxis.genome_to_array(worm.genome) for worm in [worm1, worm2, worm3]]
+    assert analytics.count == 3
+    assert analytics.mean == pytest.approx(np.mean(arrays, axis=0))
+    assert analytics.variance() == pytest.approx(np.var(arrays, axis=0))
+    assert analytics.diversity() == pytest.approx(np.var(arrays, axis=0).mean())
+
+    analytics.remove(worm3)
+    assert analytics.count == 2
+    assert analytics.mean == pytest.approx(np.mean(arrays[:2], axis=0))
+    assert analytics.variance() == pytest.approx(np.var(arrays[:2], axis=0))
+
+    analytics.stepped, analytics.in_light = 4, 1
+    assert analytics.light_fraction() == 0.25
+    analytics.record(7)
+    series = analytics.time_series()
+    assert list(series["tick"]) == [7]
+    assert list(series["pop_size"]) == [2]
+    assert list(series["light_fraction"]) == [0.25]
+    assert series["diversity"][0] == pytest.approx(analytics.diversity())
+    assert analytics.last_light_fraction == 0.25
+    assert analytics.stepped == analytics.in_light == 0
+
+    analytics.remove(worm2)
+    analytics.remove(worm1)
+    assert analytics.count == 0
+    assert not analytics.mean.any()
+    assert not analytics.variance().any()
+
+
+def test_analytics_save(ho, tmpdir):
+    analytics = phototaxis.Analytics()
+    analytics.add(ho.worm())
+    analytics.record(0)
+    analytics.record(1)
+    analytics.save(str(tmpdir.join("analytics.npz")))
+    saved = np.load(str(tmpdir.join("analytics.npz")))
+    assert list(saved["tick"]) == [0, 1]
+    assert saved["mean"].shape == (2, 4, 5, 5)
+    assert list(saved["matrices"]) == phototaxis.GENOME_MATRICES
+
+    analytics.save(str(tmpdir.join("report.npz")), reason="converged", final_pop_size=1)
+    saved = np.load(str(tmpdir.join("report.npz")))
+    assert saved["pop_size"].shape == (2,)
+    assert saved["reason"] == "converged"
+    assert saved["final_pop_size"] == 1
+
+    with pytest.raises(ValueError) as err:
+        analytics.save(str(tmpdir.join("clash.npz")), pop_size=1, states=[])
+    assert "Metadata keys clash with saved arrays: pop_size, states" in str(err)
+
+
+def test_analytics_chunks(ho, tmpdir):
+    analytics = phototaxis.Analytics(record_every=2, chunk_size=3)
+    analytics.add(ho.worm())
+    for tick in range(15):
+        analytics.stepped, analytics.in_light = 2, tick % 2
+        analytics.record(tick)
+    assert analytics.last_light_fraction == 0
+    assert analytics.rows == 8
+    assert len(analytics.chunks) == 2
+    assert analytics.chunk_rows == 2
+    series = analytics.time_series()
+    assert list(series["tick"]) == [0, 2, 4, 6, 8, 10, 12, 14]
+    assert series["mean"].shape == (8, 4, 5, 5)
+
+    # Spooled chunks go to disk and the buffer is reused
+    spool = str(tmpdir.join("spool"))
+    analytics = phototaxis.Analytics(chunk_size=3, spool_dir=spool)
+    analytics.add(ho.worm())
+    for tick in range(7):
+        analytics.record(tick)
+    assert not analytics.chunks
+    assert analytics.chunk_rows == 1
+    assert sorted(os.listdir(spool)) == sorted("%s.bin" % key for key in analytics.fields)
+    series = analytics.time_series()
+    assert list(series["tick"]) == list(range(7))
+    assert series["variance"].shape == (7, 4, 5, 5)
+    assert series["mean"][6] == pytest.approx(analytics.mean)
+
+    analytics.flush()
+    assert analytics.chunk_rows == 0
+    assert list(analytics.time_series()["tick"]) == list(range(7))
+
+    with pytest.raises(ValueError) as err:
+        phototaxis.Analytics(record_every=0)
+    assert "record_every and chunk_size must be positive integers" in str(err)
+
+
+def test_main_saves_analytics(monkeypatch, tmpdir):
+    monkeypatch.setattr(phototaxis, "event_handler", lambda: None)
+    analytics_file = str(tmpdir.join("analytics.npz"))
+    phototaxis.seed(2)
+    report = phototaxis.main(20, 1, 20, analytics_file=analytics_file, headless=True,
+                             monitor=phototaxis.ConvergenceMonitor(window=10, max_ticks=5))
+    saved = np.load(analytics_file)
+    assert saved["pop_size"].shape == (report["ticks"],)
+    assert saved["final_pop_size"] == report["pop_size"] == saved["pop_size"][-1]
+    assert saved["final_reason"] == "tick budget"
+    assert not os.path.exists("%s.spool" % analytics_file)
+
+
+def test_sliding_window():
+    window = phototaxis.SlidingWindow(3)
+    for val in [1, 2, 3]:
+        window.push(val)
+    assert window.full()
+    assert window.mean() == 2
+    assert window.std() == pytest.approx(np.std([1, 2, 3]))
+    window.push(10)
+    assert list(window.values) == [2, 3, 10]
+    assert window.mean() == 5
+    assert window.std() == pytest.approx(np.std([2, 3, 10]))
+
+    window = phototaxis.SlidingWindow(2)
+    window.push(np.array([1., 2.]))
+    window.push(np.array([3., 2.]))
+    assert list(window.mean()) == [2, 2]
+    assert list(window.std()) == [1, 0]
+
+    with pytest.raises(ValueError) as err:
+        phototaxis.SlidingWindow(1)
+    assert "Window size must be at least 2" in str(err)
+
+
+def test_convergence_monitor(ho, monkeypatch):
+    world = ho.world()
+    world.sum_suntan, world.sum_food_eaten = 100, 50
+    monitor = phototaxis.ConvergenceMonitor(window=3, tolerance=0.05)
+    assert monitor.update(world, 0) is None
+    assert monitor.update(world, 1) is None
+    assert monitor.update(world, 2) == "converged"
+    report = monitor.report(world)
+    assert report["reason"] == "converged"
+    assert report["ticks"] == 3
+    assert report["sum_suntan"] == 100
+
+    monitor = phototaxis.ConvergenceMonitor(window=3, tolerance=0.05, max_ticks=3)
+    for tick, suntan in enumerate([100, 200, 300]):
+        world.sum_suntan = suntan
+        reason = monitor.update(world, tick)
+    assert reason == "tick budget"
+
+    monitor = phototaxis.ConvergenceMonitor(window=3, genome_tolerance=0.01)
+    world.sum_suntan = 100
+    monitor.update(world, 0)
+    world.analytics.add(ho.worm())
+    monitor.update(world, 1)
+    assert monitor.update(world, 2) is None
+
+    monkeypatch.setattr(phototaxis.time, "time", lambda *_: 0)
+    monitor = phototaxis.ConvergenceMonitor(window=3, max_seconds=10)
+    assert monitor.update(world, 0) is None
+    monkeypatch.setattr(phototaxis.time, "time", lambda *_: 10)
+    assert monitor.update(world, 1) == "time budget"
+    assert monitor.report(world)["seconds"] == 10
+
+
 def test_worm_init(ho):
     worm = phototaxis.Worm(ho.world(), ho.genome())
     assert worm.world
@@ -124,24 +391,42 @@ def test_worm_init(ho):
     assert worm.time_in_light == 1
     assert worm.age == 0
     assert worm.world.pop_size == 1
+    assert worm.world.analytics.count == 1
 
+    worm = phototaxis.Worm(ho.world(), ho.genome(), location=(3, 1))
+    assert (worm.x, worm.y) == (3, 1)
 
-def test_worm_step(ho):
+
+def test_worm_step(ho, monkeypatch):
     worm = ho.worm()
     worm.step = phototaxis.Worm.step
-    worm.move = lambda *_: True
+    moves = []
+    worm.move = lambda lit: moves.append(lit)
 
     worm.x, worm.y = 1, 2
     worm.step(worm)
     assert worm.age == 1
     assert worm.time_in_light == 2
     assert worm.world.sum_suntan == 2
+    assert worm.world.analytics.in_light == 1
 
     worm.x, worm.y = 2, 2
     worm.step(worm)
     assert worm.age == 2
     assert worm.time_in_light == 1
     assert worm.world.sum_suntan == 1
+    assert worm.world.analytics.in_light == 1
+    assert worm.world.analytics.stepped == 2
+    assert moves == [True, False]
+
+    # Dim light is only sampled once per step, and move() sees the same answer
+    worm.world.light[3, 3] = 0.5
+    worm.x, worm.y = 3, 3
+    draws = iter([0.4, 0.9])
+    monkeypatch.setattr(phototaxis.rand, "random", lambda *_: next(draws))
+    worm.step(worm)
+    assert worm.time_in_light == 2
+    assert moves[-1] is True
 
 
 def test_worm_move(monkeypatch, capsys, ho):
@@ -296,8 +581,9 @@ def test_worm_breed(ho, monkeypatch):
     assert offspring.genome.p_light_wall["fwd"] == OrderedDict([('fwd', 1), ('rev', 0.13333333333333333), ('left', 0.2),
                                                                 ('right', 0.26666666666666666),
                                                                 ('stop', 0.3333333333333333)])
-    assert (offspring.x, offspring.y) == (3, 3)
-    assert worm1.world.grid[3][3] == 3
+    assert (offspring.x, offspring.y) == (1, 3)
+    assert worm1.world.grid[1][3] == 3
+    assert worm1.world.analytics.count == 1
 
 
 def test_worm_adjacent_spaces(ho):
@@ -308,6 +594,184 @@ def test_worm_adjacent_spaces(ho):
                                           (3, 1), (3, 2), (3, 3)]
 
 
+def test_is_lit(ho, monkeypatch):
+    world = ho.world()
+    world.light[3, 3] = 0.5
+    monkeypatch.setattr(phototaxis.rand, "random", lambda *_: 1 / 0)  # Must not be called
+    assert phototaxis.is_lit(world, 1, 1)
+    assert not phototaxis.is_lit(world, 2, 2)
+
+    monkeypatch.setattr(phototaxis.rand, "random", lambda *_: 0.4)
+    assert phototaxis.is_lit(world, 3, 3)
+    monkeypatch.setattr(phototaxis.rand, "random", lambda *_: 0.6)
+    assert not phototaxis.is_lit(world, 3, 3)
+
+
+def test_grid_to_rgb():
+    grid = [[0, 1, 2], [3, 4, 0]]
+    rgb = phototaxis.grid_to_rgb(grid)
+    assert rgb.shape == (2, 3, 3)
+    assert rgb.dtype == np.uint8
+    assert tuple(rgb[0][2]) == phototaxis.type_colors[2]
+    assert tuple(rgb[1][0]) == phototaxis.type_colors[3]
+    assert tuple(rgb[1][2]) == phototaxis.type_colors[0]
+
+    rgb = phototaxis.grid_to_rgb(grid, scale=2)
+    assert rgb.shape == (4, 6, 3)
+    assert tuple(rgb[3][1]) == phototaxis.type_colors[3]
+
+
+def test_frame_exporter_images(ho, tmpdir):
+    world = ho.world()
+    world.grid = [[1, 2, 3, 4] for _ in range(4)]
+    exporter = phototaxis.FrameExporter(str(tmpdir.join("frames")), every=2)
+    assert exporter.capture(world, 0)
+    assert not exporter.capture(world, 1)
+    assert exporter.capture(world, 2)
+    exporter.close()
+    assert sorted(tmpdir.join("frames").listdir()) == [tmpdir.join("frames", "frame_00000000.png"),
+                                                        tmpdir.join("frames", "frame_00000001.png")]
+
+    with pytest.raises(ValueError) as err:
+        phototaxis.FrameExporter(str(tmpdir.join("frames")), every=0)
+    assert "every must be a positive integer" in str(err)
+
+
+def test_frame_exporter_raw(ho, tmpdir):
+    world = ho.world()
+    world.grid = [[0, 1, 2, 3], [4, 4, 4, 4], [1, 1, 1, 1], [1, 1, 1, 1]]
+    exporter = phototaxis.FrameExporter(str(tmpdir.join("frames.rgb")), fmt="raw")
+    for tick in range(3):
+        exporter.capture(world, tick)
+    exporter.close()
+    stream = np.fromfile(str(tmpdir.join("frames.rgb")), dtype=np.uint8).reshape(3, 4, 4, 3)
+    # Rows of the raw stream are y, columns are x
+    assert tuple(stream[2][3][0]) == phototaxis.type_colors[3]
+    assert tuple(stream[2][0][1]) == phototaxis.type_colors[4]
+
+
+def test_array_to_genome(ho):
+    array = phototaxis.genome_to_array(ho.genome())
+    array[2][1][0] = 0.5
+    genome = phototaxis.array_to_genome(array)
+    assert list(genome.p_dark["fwd"].items()) == [(state, indx / 15) for state, indx in
+                                                  zip(phototaxis.STATES, range(1, 6))]
+    assert genome.p_dark_wall["rev"]["fwd"] == 0.5
+    assert genome.as_array() is array
+
+
+def breeding_population(ho):
+    world = ho.world()
+    worms = [phototaxis.Worm(world, ho.genome(), location=loc) for loc in [(1, 1), (1, 1), (2, 2), (3, 3)]]
+    worms[1].genome = phototaxis.array_to_genome(np.zeros((4, 5, 5)))
+    worms[0].time_in_light = 98
+    world.sum_suntan = 101
+    return world, worms
+
+
+def test_breed_individually(ho, monkeypatch):
+    monkeypatch.setattr(phototaxis, "rand", Random(1))
+    world, worms = breeding_population(ho)
+    offspring = phototaxis.breed_individually(worms, world)
+    assert len(offspring) == 1
+    assert (offspring[0].x, offspring[0].y) in [(1, 1), (1, 2), (2, 1), (2, 2)]
+    assert world.pop_size == 5
+
+
+def test_breed_population(ho, monkeypatch):
+    monkeypatch.setattr(phototaxis, "rand", Random(1))
+    monkeypatch.setattr(phototaxis, "np_rand", np.random.default_rng(2))
+    world, worms = breeding_population(ho)
+    offspring = phototaxis.breed_population(worms, world)
+    assert len(offspring) == 1
+    assert (offspring[0].x, offspring[0].y) in [(1, 1), (1, 2), (2, 1), (2, 2)]
+    assert world.grid[offspring[0].x][offspring[0].y] == 3
+    assert world.pop_size == 5
+    assert world.analytics.count == 5
+
+    # Mated with the all-zero genome, so every transition probability came from one parent or the other
+    child = offspring[0].genome.as_array()
+    parent = worms[0].genome.as_array()
+    assert np.all((child == 0) | (child == parent))
+    assert 0 < np.count_nonzero(child) < child.size
+    assert offspring[0].genome.p_light["stop"]["stop"] == child[1][4][4]
+
+    assert phototaxis.breed_population([], world) == []
+    world.sum_suntan = 10 ** 9
+    assert phototaxis.breed_population(worms, world) == []
+
+
+def _shared_reader(name, queue):
+    # Record anything the reader does to the resource tracker, which is shared with the owner under spawn
+    tracked = []
+    register, unregister = phototaxis.resource_tracker.register, phototaxis.resource_tracker.unregister
+    phototaxis.resource_tracker.register = lambda *args: tracked.append(("register",) + args) or register(*args)
+    phototaxis.resource_tracker.unregister = lambda *args: tracked.append(("unregister",) + args) or unregister(*args)
+    reader = phototaxis.SharedState(name)
+    snapshot = reader.read()
+    reader.close()
+    queue.put((snapshot["tick"], list(snapshot["x"]), tracked))
+
+
+def test_shared_state(ho):
+    world = ho.world()
+    world.grid = [[1, 2, 3, 4] for _ in range(4)]
+    worms = [phototaxis.Worm(world, ho.genome(), location=loc) for loc in [(1, 1), (2, 3), (3, 2)]]
+    worms[1].state = "stop"
+    writer = phototaxis.SharedState(grid_side=4, capacity=2)
+    try:
+        assert writer.sequence == 0
+        writer.publish(world, worms, 7)
+        assert writer.sequence == 2
+
+        reader = phototaxis.SharedState(writer.name)
+        assert reader.capacity == 2
+        assert not reader.owner
+        snapshot = reader.read()
+        assert snapshot["tick"] == 7
+        assert snapshot["pop_size"] == 3
+        assert list(snapshot["x"]) == [1, 2]
+        assert list(snapshot["y"]) == [1, 3]
+        assert snapshot["state"][1] == phototaxis.STATES.index("stop")
+        assert snapshot["genome"][0] == pytest.approx(phototaxis.genome_to_array(ho.genome()))
+        assert snapshot["grid"].tolist() == world.grid
+        assert reader.genomes_current
+
+        # Zero-copy views see the next publish straight away
+        worms[0].x = 3
+        writer.publish(world, worms[:1], 8, genomes=False)
+        assert reader.arrays["x"][0] == 3
+        snapshot = reader.read()
+        assert list(snapshot["x"]) == [3]
+        assert "genome" not in snapshot  # Left over from the last publish, so not current
+        assert not reader.genomes_current
+
+        # A publish in progress (odd sequence) can't be read
+        writer.header[writer.SEQUENCE] += 1
+        with pytest.raises(RuntimeError) as err:
+            reader.read(retries=2)
+        assert "Unable to read a consistent snapshot" in str(err)
+        writer.header[writer.SEQUENCE] += 1
+
+        for method in ["fork", "spawn"]:
+            context = multiprocessing.get_context(method)
+            queue = context.Queue()
+            process = context.Process(target=_shared_reader, args=(writer.name, queue))
+            process.start()
+            assert queue.get(timeout=30) == (8, [3], [])
+            process.join()
+            phototaxis.SharedState(writer.name).close()  # Still there after the reader exits
+        reader.close()
+    finally:
+        writer.close()
+
+    with pytest.raises(FileNotFoundError):
+        phototaxis.SharedState(writer.name)
+    with pytest.raises(ValueError) as err:
+        phototaxis.SharedState(grid_side=4, capacity=0)
+    assert "capacity must be a positive integer" in str(err)
+
+
 def test_random_transition_matrix(monkeypatch):
     rand = Random(1)
     monkeypatch.setattr(phototaxis, "rand", rand)
@@ -317,3 +781,34 @@ def test_random_transition_matrix(monkeypatch):
         assert len(subset) == 3
         assert sum([val for key_key, val in subset.items()]) == 1
     assert trans_mat["a"]["a"] == 0.09523809523809523
+
+
+def test_seed():
+    phototaxis.seed(5)
+    first = (phototaxis.rand.random(), phototaxis.np_rand.random())
+    phototaxis.seed(5)
+    assert (phototaxis.rand.random(), phototaxis.np_rand.random()) == first
+
+
+def test_setup_world():
+    world, worms = phototaxis.setup_world(10, 1, 5, [(1, [phototaxis.LightSpot(5, 5, 1)])])
+    assert len(worms) == world.pop_size == 5
+    assert world.light[5, 5] == 1
+    assert len(world.light_field.cache) == 1
+
+    with pytest.raises(ValueError) as err:
+        phototaxis.setup_world(10, 3, 5)
+    assert "len_side is not divisible by pixel_size" in str(err)
+
+
+def test_simulate():
+    phototaxis.seed(2)
+    world, worms = phototaxis.setup_world(20, 1, 20)
+    run = phototaxis.simulate(world, worms, 20)
+    assert next(run) == 0
+    assert next(run) == 1
+    assert len(worms) == world.pop_size == world.analytics.count
+    assert list(world.analytics.time_series()["tick"]) == [0, 1]
+    grid_values = set(val for row in world.grid for val in row)
+    assert 0 in grid_values and 1 in grid_values
+    assert grid_values <= {0, 1, 3, 4}
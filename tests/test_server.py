@@ -0,0 +1,157 @@
+import asyncio
+import pytest
+import phototaxis
+import server
+
+SMALL = {"len_side": 20, "pop_size": 20, "ticks": 5, "seed": 1}
+
+
+def run_with_server(test, workers=1):
+    async def wrapper():
+        run_server = server.RunServer(port=0, workers=workers, warm_sizes=[(20, 1)])
+        await run_server.start()
+        try:
+            return await test(run_server)
+        finally:
+            await run_server.close()
+    return asyncio.run(wrapper())
+
+
+async def collect(message, run_server):
+    return [response async for response in server.request(message, port=run_server.port)]
+
+
+def test_make_config():
+    config = server.make_config({"ticks": 10})
+    assert config["ticks"] == 10
+    assert config["len_side"] == 100
+
+    with pytest.raises(ValueError) as err:
+        server.make_config({"foo": 1})
+    assert "Unknown config settings: foo" in str(err)
+
+    with pytest.raises(ValueError) as err:
+        server.make_config({"len_side": 10, "pixel_size": 3})
+    assert "len_side is not divisible by pixel_size" in str(err)
+
+    with pytest.raises(ValueError) as err:
+        server.make_config({"pixel_size": 0})
+    assert "len_side and pixel_size must be positive integers" in str(err)
+
+    with pytest.raises(ValueError) as err:
+        server.make_config({"ticks": 0})
+    assert "ticks and stats_every must be positive integers" in str(err)
+
+
+def test_light_schedule():
+    assert server.light_schedule(server.make_config({})) is None
+
+    schedule = server.light_schedule(server.make_config({"light": [[5, 5, 2], {"x": 1, "y": 1, "radius": 1,
+                                                                                "gradient": True}]}))
+    assert len(schedule) == 1 and schedule[0][0] == 1
+    assert schedule[0][1][1].gradient
+
+    schedule = server.light_schedule(server.make_config({"light_schedule": [[10, [[5, 5, 2]]], [5, []]]}))
+    assert [duration for duration, spots in schedule] == [10, 5]
+    assert isinstance(schedule[0][1][0], phototaxis.LightSpot)
+
+
+def test_warm_up(monkeypatch):
+    monkeypatch.setattr(phototaxis, "dish_cache", {})
+    server.warm_up([(10, 1)])
+    assert list(phototaxis.dish_cache) == [(10, 1)]
+
+
+def test_submit_and_watch():
+    async def test(run_server):
+        responses = await collect({"cmd": "submit", "config": SMALL, "watch": True}, run_server)
+        status = await collect({"cmd": "status"}, run_server)
+        cancelled = await collect({"cmd": "cancel", "job": 1}, run_server)
+        return responses, status, cancelled
+
+    responses, status, cancelled = run_with_server(test)
+    assert responses[0] == {"job": 1, "status": "queued"}
+    assert [response["tick"] for response in responses[1:-1]] == [0, 1, 2, 3, 4]
+    assert responses[-1]["status"] == "done"
+    assert responses[-1]["report"]["reason"] == "tick budget"
+    assert responses[-1]["report"]["pop_size"] == responses[-2]["pop_size"]
+    assert status[0]["jobs"][0]["status"] == "done"
+    assert status[0]["jobs"][0]["last_stats"]["tick"] == 4
+    assert cancelled == [{"job": 1, "status": "done"}]  # Too late to cancel
+
+
+def test_close_without_jobs():
+    async def test(run_server):
+        return run_server.jobs
+
+    assert run_with_server(test) == {}
+
+
+def test_seeded_jobs_match():
+    async def test(run_server):
+        first = await collect({"cmd": "submit", "config": SMALL, "watch": True}, run_server)
+        second = await collect({"cmd": "submit", "config": SMALL, "watch": True}, run_server)
+        return first, second
+
+    first, second = run_with_server(test)
+    assert [response.get("pop_size") for response in first[1:-1]] == \
+           [response.get("pop_size") for response in second[1:-1]]
+
+
+def test_cancel():
+    async def test(run_server):
+        long_run = dict(SMALL, ticks=100000)
+        running = run_server.submit(long_run)
+        # The pool passes a couple of jobs on to its call queue ahead of time, and those can't be withdrawn any more
+        queued = [run_server.submit(long_run) for _ in range(4)]
+        while running.last_stats is None:
+            await asyncio.sleep(0.05)
+        cancelled = [await collect({"cmd": "cancel", "job": job.id}, run_server) for job in reversed(queued)]
+        cancelling = await collect({"cmd": "cancel", "job": running.id}, run_server)
+        await asyncio.wait_for(asyncio.gather(*[job.finished.wait() for job in [running] + queued]), 10)
+        return running, queued, cancelled, cancelling
+
+    running, queued, cancelled, cancelling = run_with_server(test)
+    assert cancelled[0] == [{"job": 5, "status": "cancelled"}]
+    assert all(reply[0]["status"] in ["cancelled", "cancelling"] for reply in cancelled)
+    assert cancelling == [{"job": 1, "status": "cancelling"}]
+    assert all(job.status == "cancelled" and job.report is None for job in queued)
+    assert running.status == "cancelled"
+    assert running.report["reason"] == "cancelled"
+    assert running.report["ticks"] < 100000
+
+
+def test_cancel_after_pickup():
+    async def test(run_server):
+        job = run_server.submit(dict(SMALL, ticks=100000))
+        while job.last_stats is None:
+            await asyncio.sleep(0.05)
+        # The "running" message may not have arrived yet when a worker has already taken the job
+        job.status = "queued"
+        assert run_server.cancel(job.id) == (job, "cancelling")
+        assert not job.future.cancelled()
+        await asyncio.wait_for(job.finished.wait(), 10)
+        return job
+
+    job = run_with_server(test)
+    assert job.status == "cancelled"
+    assert job.report["reason"] == "cancelled"
+
+
+def test_failed_job_and_bad_requests():
+    async def test(run_server):
+        failed = await collect({"cmd": "submit", "config": dict(SMALL, light=[[5, 5, 2, 3]]), "watch": True},
+                               run_server)
+        bad_config = await collect({"cmd": "submit", "config": {"foo": 1}}, run_server)
+        bad_pixel_size = await collect({"cmd": "submit", "config": {"pixel_size": 0}}, run_server)
+        bad_command = await collect({"cmd": "foo"}, run_server)
+        missing_job = await collect({"cmd": "watch", "job": 99}, run_server)
+        return failed, bad_config, bad_pixel_size, bad_command, missing_job
+
+    failed, bad_config, bad_pixel_size, bad_command, missing_job = run_with_server(test)
+    assert failed[-1]["status"] == "failed"
+    assert "Light intensity must be between 0 and 1" in failed[-1]["error"]
+    assert "Unknown config settings" in bad_config[0]["error"]
+    assert bad_pixel_size == [{"error": "ValueError: len_side and pixel_size must be positive integers"}]
+    assert bad_command == [{"error": "ValueError: Unknown command 'foo'"}]
+    assert "KeyError" in missing_job[0]["error"]
@@ -0,0 +1,88 @@
+import pytest
+import numpy as np
+import phototaxis
+import validation
+
+RUN = {"len_side": 20, "starting_pop_size": 20}
+
+
+def test_run_engine():
+    series, elapsed = validation.run_engine(validation.ENGINES["batched"], 1, 10, **RUN)
+    assert list(series) == validation.METRICS
+    assert all(len(values) == 10 for values in series.values())
+    assert series["pop_size"][0] > 0
+    states = sum(series["state_%s" % state] for state in phototaxis.STATES)
+    assert np.allclose(states, 1)
+    assert series["genome_drift"][-1] > 0
+    assert elapsed > 0
+
+
+def test_summarize():
+    series = {"a": np.array([10., 1., 2., 3.])}
+    assert validation.summarize(series, 1) == {"a": 2.}
+
+
+def test_tost():
+    rng = np.random.default_rng(1)
+    ref_vals, cand_vals = rng.normal(100, 1, 20), rng.normal(100, 1, 20)
+    assert validation.tost(ref_vals, cand_vals, 2) < 0.05
+    assert validation.tost(ref_vals, cand_vals + 5, 2) > 0.5
+    assert validation.tost(ref_vals, cand_vals, 0.01) > 0.05  # Too few samples to show a difference this small
+    assert validation.tost(ref_vals[:1], cand_vals[:1], 2) == 1
+    assert validation.tost(np.ones(3), np.ones(3) * 1.5, 1) == 0
+    assert validation.tost(np.ones(3), np.ones(3) * 3, 1) == 1
+
+
+def test_compare():
+    reference = [{metric: 1. + seed / 1000 for metric in validation.METRICS} for seed in range(4)]
+    results = validation.compare(reference, reference)
+    assert all(result["equivalent"] and result["tost_p"] == 0 and result["ks_p"] == 1 for result in results.values())
+
+    # Equal means are not enough if the runs are too noisy to rule out a difference as large as the margin
+    noisy = [{metric: 1. + seed for metric in validation.METRICS} for seed in range(4)]
+    shifted = [{metric: 1.0001 + seed for metric in validation.METRICS} for seed in range(4)]
+    results = validation.compare(noisy, shifted)
+    assert not any(result["equivalent"] for result in results.values())
+
+    candidate = [{metric: 1.001 + seed / 1000 for metric in validation.METRICS} for seed in range(4)]
+    results = validation.compare(reference, candidate)
+    assert all(result["equivalent"] for result in results.values())
+    assert results["pop_size"]["margin"] == validation.MARGINS["pop_size"]
+    assert results["pop_size"]["rel_diff"] == pytest.approx(0.001 / 1.0015)
+
+    candidate = [{metric: 100. + seed for metric in validation.METRICS} for seed in range(4)]
+    results = validation.compare(reference, candidate)
+    assert not any(result["equivalent"] for result in results.values())
+
+    # Matching means but a different spread across seeds is caught by the KS test
+    rng = np.random.default_rng(2)
+    reference = [{metric: val for metric in validation.METRICS} for val in rng.normal(1, 0.001, 40)]
+    candidate = [{metric: val for metric in validation.METRICS} for val in rng.choice([0.99, 1.01], 40)]
+    results = validation.compare(reference, candidate)
+    assert all(result["tost_p"] < 0.05 for result in results.values())
+    assert not any(result["equivalent"] for result in results.values())
+    assert results["pop_size"]["ks_stat"] > 0.4
+
+
+def test_compare_other_seeds():
+    # The same engine on different seeds is a different random stream with the same distribution, so the
+    # distribution test must not reject it
+    engine = validation.ENGINES["reference"]
+    first = [validation.summarize(validation.run_engine(engine, seed, 60, **RUN)[0], 20) for seed in range(8)]
+    second = [validation.summarize(validation.run_engine(engine, seed, 60, **RUN)[0], 20) for seed in range(8, 16)]
+    results = validation.compare(first, second)
+    assert all(result["ks_p"] >= 0.05 / len(validation.METRICS) for result in results.values())
+
+
+def test_check_determinism():
+    assert validation.check_determinism(validation.ENGINES["reference"], 3, 5, **RUN)
+
+
+def test_validate():
+    report = validation.validate(seeds=range(2), ticks=10, **RUN)
+    assert list(report) == ["reference", "batched"]
+    assert report["reference"]["speedup"] == 1
+    assert report["reference"]["equivalent"]
+    assert report["batched"]["deterministic"]
+    assert list(report["batched"]["metrics"]) == validation.METRICS
+    assert "batched: " in validation.format_report(report)
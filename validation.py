@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""
+Regression harness: run the reference implementation and any faster engines on the same fixed seeds, check that the
+faster engines produce statistically equivalent populations, and report how much faster they are.
+
+The reference is the current simulate() loop with breed_individually(), not the original main() loop. It already
+shares is_lit(), the in-place age sort, the numpy-seeded poisson draw and the rewritten grid loop with every other
+engine, so this only checks the engines against each other (e.g. batched vs per-worm breeding).
+"""
+import time
+import argparse
+import numpy as np
+from collections import OrderedDict
+from scipy import stats
+import phototaxis
+
+# An engine is a set of keyword arguments for phototaxis.simulate(). The first entry is the reference.
+ENGINES = OrderedDict([("reference", {"breeder": phototaxis.breed_individually}),
+                       ("batched", {"breeder": phototaxis.breed_population})])
+METRICS = ["pop_size", "sum_food_eaten", "sum_suntan"] + ["state_%s" % state for state in phototaxis.STATES] + \
+          ["light_fraction", "genome_drift"]
+# Largest difference in post-burn-in means that still counts as equivalent, relative to the reference mean (or
+# absolute, if the reference mean is 0)
+MARGINS = OrderedDict([("pop_size", 0.02), ("sum_food_eaten", 0.10), ("sum_suntan", 0.10)] +
+                      [("state_%s" % state, 0.10) for state in phototaxis.STATES] +
+                      [("light_fraction", 0.10), ("genome_drift", 0.25)])
+
+
+def default_light(len_side):
+    """
+    A single static spot in the middle of the dish, so selection on light preference has something to act on
+    :param len_side: Length of a side of the world
+    :return: LightField schedule
+    """
+    return [(1, [phototaxis.LightSpot(len_side / 2, len_side / 2, len_side / 5)])]
+
+
+def run_engine(engine, seed, ticks, len_side=50, pixel_size=1, starting_pop_size=200, light_schedule=None):
+    """
+    Run a single seeded simulation and collect a time series of every metric
+    :param engine: dict of keyword arguments for phototaxis.simulate()
+    :param seed: Integer seed
+    :param ticks: Number of ticks to run
+    :param len_side: Length of a side of the world
+    :param pixel_size: How many side units are contained in a single 'pixel' in the actual grid
+    :param starting_pop_size: Starting (and mean) population size
+    :param light_schedule: LightField schedule. Default is default_light().
+    :return: (OrderedDict of metric name -> np.array with one value per tick, seconds spent simulating)
+    """
+    light_schedule = light_schedule if light_schedule else default_light(len_side)
+    phototaxis.seed(seed)
+    world, worms = phototaxis.setup_world(len_side, pixel_size, starting_pop_size, light_schedule)
+    start_mean = world.analytics.mean.copy()
+    series = OrderedDict([(metric, np.zeros(ticks)) for metric in METRICS])
+
+    elapsed = 0.
+    timer = time.perf_counter()
+    for tick in phototaxis.simulate(world, worms, starting_pop_size, **engine):
+        elapsed += time.perf_counter() - timer
+        series["pop_size"][tick] = world.pop_size
+        series["sum_food_eaten"][tick] = world.sum_food_eaten
+        series["sum_suntan"][tick] = world.sum_suntan
+        states = [worm.state for worm in worms]
+        for state in phototaxis.STATES:
+            series["state_%s" % state][tick] = states.count(state) / len(states) if states else 0.
+        series["light_fraction"][tick] = world.analytics.last_light_fraction
+        series["genome_drift"][tick] = np.sqrt(((world.analytics.mean - start_mean) ** 2).sum())
+        if tick + 1 == ticks:
+            break
+        timer = time.perf_counter()
+    return series, elapsed
+
+
+def summarize(series, burn_in):
+    """
+    Reduce a time series to one value per metric (the mean after burn-in), so each seed is one independent sample
+    :param series: Output of run_engine()
+    :param burn_in: Number of ticks to drop from the start of the run
+    :return: OrderedDict of metric name -> float
+    """
+    return OrderedDict([(metric, float(values[burn_in:].mean())) for metric, values in series.items()])
+
+
+def tost(ref_vals, cand_vals, margin):
+    """
+    Two one-sided Welch t-tests: is the difference in means inside (-margin, margin)?
+    :param ref_vals: np.array of reference values
+    :param cand_vals: np.array of candidate values
+    :param margin: Largest absolute difference in means that still counts as equivalent
+    :return: p-value. Small values mean the two are equivalent.
+    """
+    diff = cand_vals.mean() - ref_vals.mean()
+    if len(ref_vals) < 2 or len(cand_vals) < 2:
+        return 1.
+    ref_var, cand_var = ref_vals.var(ddof=1) / len(ref_vals), cand_vals.var(ddof=1) / len(cand_vals)
+    std_err = np.sqrt(ref_var + cand_var)
+    if not std_err:
+        return 0. if abs(diff) < margin else 1.
+    dof = (ref_var + cand_var) ** 2 / (ref_var ** 2 / (len(ref_vals) - 1) + cand_var ** 2 / (len(cand_vals) - 1))
+    lower = stats.t.sf((diff + margin) / std_err, dof)
+    upper = stats.t.cdf((diff - margin) / std_err, dof)
+    return float(max(lower, upper))
+
+
+def compare(reference, candidate, alpha=0.05, margins=None):
+    """
+    Equivalence test (TOST) on the per-seed means of each metric, against the margins in MARGINS. Every metric must
+    pass at `alpha`, which keeps the family-wise error at `alpha` without correction. A two-sample Kolmogorov-Smirnov
+    test on the same per-seed means also checks that the spread across seeds matches, and a metric fails if KS rejects
+    at the Bonferroni corrected alpha. Only whole seeds are independent of each other, so individual ticks are never
+    used as samples.
+    :param reference: List of summarize() outputs from the reference engine
+    :param candidate: List of summarize() outputs from the engine being validated
+    :param alpha: Family-wise significance level
+    :param margins: Relative equivalence margin for each metric. Default is MARGINS.
+    :return: OrderedDict of metric name -> OrderedDict(reference, candidate, rel_diff, margin, tost_p, ks_stat, ks_p,
+             equivalent)
+    """
+    margins = margins if margins else MARGINS
+    results = OrderedDict()
+    for metric in METRICS:
+        ref_vals = np.array([summary[metric] for summary in reference])
+        cand_vals = np.array([summary[metric] for summary in candidate])
+        ref_mean, cand_mean = ref_vals.mean(), cand_vals.mean()
+        margin = margins[metric] * abs(ref_mean) if ref_mean else margins[metric]
+        tost_p = 0. if np.array_equal(ref_vals, cand_vals) else tost(ref_vals, cand_vals, margin)
+        rel_diff = (cand_mean - ref_mean) / abs(ref_mean) if ref_mean else float(cand_mean != ref_mean)
+        ks_result = stats.ks_2samp(ref_vals, cand_vals)
+        ks_stat, ks_p = float(ks_result.statistic), float(ks_result.pvalue)
+        equivalent = tost_p < alpha and ks_p >= alpha / len(METRICS)
+
+        results[metric] = OrderedDict([("reference", float(ref_mean)), ("candidate", float(cand_mean)),
+                                       ("rel_diff", float(rel_diff)), ("margin", float(margins[metric])),
+                                       ("tost_p", tost_p), ("ks_stat", ks_stat), ("ks_p", ks_p),
+                                       ("equivalent", bool(equivalent))])
+    return results
+
+
+def check_determinism(engine, seed, ticks, **run_kwargs):
+    """
+    The same seed must always give exactly the same run
+    :return: bool
+    """
+    first = run_engine(engine, seed, ticks, **run_kwargs)[0]
+    second = run_engine(engine, seed, ticks, **run_kwargs)[0]
+    return all(np.array_equal(first[metric], second[metric]) for metric in METRICS)
+
+
+def validate(engines=None, seeds=range(20), ticks=2000, burn_in=None, alpha=0.05, **run_kwargs):
+    """
+    Run every engine on every seed and compare each to the first (reference) engine
+    :param engines: OrderedDict of engine name -> simulate() keyword arguments. Default is ENGINES.
+    :param seeds: Seeds to run each engine with
+    :param ticks: Ticks per run
+    :param burn_in: Ticks ignored at the start of each run. Default is a quarter of the run.
+    :param alpha: Family-wise significance level
+    :param run_kwargs: Passed on to run_engine()
+    :return: OrderedDict of engine name -> OrderedDict(seconds, speedup, deterministic, equivalent, metrics)
+    """
+    engines = engines if engines else ENGINES
+    seeds = list(seeds)
+    burn_in = int(ticks / 4) if burn_in is None else burn_in
+    check_ticks = min(ticks, 50)
+
+    summaries = OrderedDict()
+    report = OrderedDict()
+    for name, engine in engines.items():
+        summaries[name] = []
+        seconds = 0.
+        for seed in seeds:
+            series, elapsed = run_engine(engine, seed, ticks, **run_kwargs)
+            summaries[name].append(summarize(series, burn_in))
+            seconds += elapsed
+        report[name] = OrderedDict([("seconds", seconds),
+                                    ("deterministic", check_determinism(engine, seeds[0], check_ticks, **run_kwargs))])
+
+    reference = list(engines)[0]
+    for name in engines:
+        metrics = compare(summaries[reference], summaries[name], alpha)
+        report[name]["speedup"] = report[reference]["seconds"] / report[name]["seconds"]
+        report[name]["equivalent"] = all(result["equivalent"] for result in metrics.values())
+        report[name]["metrics"] = metrics
+    return report
+
+
+def format_report(report):
+    output = ""
+    for name, results in report.items():
+        output += "%s: %.2fs, %.2fx speedup, deterministic=%s, equivalent=%s\n" % \
+                  (name, results["seconds"], results["speedup"], results["deterministic"], results["equivalent"])
+        output += "    {:<18}{:>14}{:>14}{:>11}{:>9}{:>9}{:>9}\n".format("metric", "reference", "candidate",
+                                                                            "rel diff", "margin", "TOST p", "KS p")
+        for metric, result in results["metrics"].items():
+            output += "    {:<18}{:>14.4f}{:>14.4f}{:>11.4f}{:>9.2f}{:>9.4f}{:>9.4f}{}\n".format(
+                metric, result["reference"], result["candidate"], result["rel_diff"], result["margin"],
+                result["tost_p"], result["ks_p"], "" if result["equivalent"] else "  *")
+    return output
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog="validation", description="Compare simulation engines to the reference")
+    parser.add_argument("--seeds", type=int, default=20, help="Number of seeds per engine")
+    parser.add_argument("--ticks", type=int, default=2000, help="Ticks per run")
+    parser.add_argument("--burn_in", type=int, help="Ticks to ignore at the start of each run")
+    parser.add_argument("--len_side", type=int, default=50, help="Length of a side of the world")
+    parser.add_argument("--pop_size", type=int, default=200, help="Starting population size")
+    parser.add_argument("--alpha", type=float, default=0.05, help="Family-wise significance level")
+    in_args = parser.parse_args()
+
+    validation = validate(seeds=range(in_args.seeds), ticks=in_args.ticks, burn_in=in_args.burn_in,
+                          alpha=in_args.alpha, len_side=in_args.len_side,
+                          starting_pop_size=in_args.pop_size)
+    print(format_report(validation), end="")
+    if not all(engine["equivalent"] and engine["deterministic"] for engine in validation.values()):
+        raise SystemExit(1)